@@ -0,0 +1,58 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc adaptive ("auto") interpolation: the mode of every pair of source frames is chosen by the amount of motion between them
+"""
+import numpy as np
+import cv2
+
+from profiling import profile
+
+AUTO_MODES = ("dup", "blend", "mci")
+
+# chooses the mode of every pair on thumbnails (thumbnail_width pixels wide), so it costs a few milliseconds per pair:
+# "dup" if the frames are almost identical (mean absolute difference, in [0,1], up to dup_threshold),
+# "blend" if they barely move (99th percentile of the motion, estimated with Gunnar-Farneback on the thumbnails
+# and measured in pixels of the frames, below blend_threshold), "mci" otherwise.
+# the choice of every pair is recorded in "choices", as (index of the anchor frame, mode)
+class ModeSelector:
+    def __init__(self, dup_threshold=0.002, blend_threshold=1.0, thumbnail_width=160):
+        self.dup_threshold = dup_threshold
+        self.blend_threshold = blend_threshold
+        self.thumbnail_width = thumbnail_width
+        self.choices = [ ]
+        self.previous = None                                                    # (frame, its thumbnail): the target of a pair is the anchor of the next one
+
+    def __call__(self, anchor_frame, target_frame, index):
+        with profile("select"): mode = self.select(anchor_frame, target_frame)
+        self.choices.append((index, mode))
+
+        return mode
+
+    def select(self, anchor_frame, target_frame):
+        a, b = self.thumbnail(anchor_frame), self.thumbnail(target_frame)
+
+        if cv2.absdiff(a, b).mean() / 255 <= self.dup_threshold: return "dup"
+
+        flow = cv2.calcOpticalFlowFarneback(a, b, None, 0.5, 2, 9, 3, 5, 1.2, 0)
+        motion = np.percentile(cv2.magnitude(flow[...,0], flow[...,1]), 99) * anchor_frame.shape[1] / a.shape[1]
+
+        return "blend" if motion < self.blend_threshold else "mci"
+
+    def thumbnail(self, frame):
+        if self.previous is not None and self.previous[0] is frame: return self.previous[1]
+
+        h, w = frame.shape[:2]
+        size = (min(w, self.thumbnail_width), max(1, round(h * min(w, self.thumbnail_width) / w)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3: small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        self.previous = (frame, small)
+        return small
+
+    # number of pairs filled by every mode
+    def counts(self):
+        counts = {mode: 0 for mode in AUTO_MODES}
+        for index, mode in self.choices: counts[mode] += 1
+
+        return counts
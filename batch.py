@@ -0,0 +1,413 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc batch rendering: a queue of (input, output, fps, mode) jobs kept in a SQLite file, rendered unattended by a pool of
+ #       processes admitted by their estimated memory, with the timing and throughput of every job
+ #       python3 -m batch add clips/ -o out/ -f 60 -m blend; python3 -m batch run; python3 -m batch status
+"""
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import interpolation
+from decoder import DECODERS
+from flow import FLOW_PRESETS
+from interpolation import parse_fps, read_video_info
+
+BATCH_DB = "batch.sqlite"
+JOB_STATUSES = ("queued", "running", "done", "failed")
+MAX_ATTEMPTS = 3                                                                # runs of a job whose render process is killed, before it fails
+
+# memory model of a render (see estimate_memory_mb), measured on 540p and 1080p clips: the interpreter with numpy,
+# opencv and pyav, then the bytes per pixel of every frame of the window and of the work buffers of every mci worker
+BASE_MB = 100
+WORK_BYTES = {"dup": 0, "blend": 8, "farneback": 96, "lk": 32, "auto": 96}      # per pixel, per worker
+BIDIRECTIONAL_BYTES = 24                                                        # per pixel, per worker: second flow and warped frames
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    input TEXT NOT NULL,
+    output TEXT NOT NULL UNIQUE,
+    fps TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    fps_in TEXT,
+    frames_in INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    memory_mb REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    host TEXT,
+    pid INTEGER,
+    added REAL,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    frames_out INTEGER,
+    error TEXT
+)
+"""
+
+# ---- JOBS ----
+
+# estimated peak memory (MB) of a render of a size (w, h) video from fps_in to fps_out: the window of frames alive at the
+# same time (the ones queued in the encoder and the frame pool of interpolation.render, which grows with the multiplier
+# and the workers) plus the work buffers (flows, coordinate maps, gray frames...) of every worker. It is an upper bound:
+# the measured peaks are 10-20% lower
+def estimate_memory_mb(size, fps_in, fps_out, mode, workers=1, bidirectional=False):
+    pixels = size[0] * size[1]
+    window = interpolation.QUEUE_SIZE + 2
+    work = 0
+    if fps_out > fps_in and mode != "dup":
+        window += math.ceil(fps_out / fps_in) * (2*workers + 1)
+        work = workers * (WORK_BYTES[mode] + (BIDIRECTIONAL_BYTES if bidirectional and mode in ("farneback", "lk", "auto") else 0))
+
+    return BASE_MB + pixels * (3*window + work) / 1000000
+
+# manifest: a csv file with the columns input, output and, optionally, fps and mode (default_fps and default_mode
+# if missing or empty); the paths are relative to the manifest
+def read_manifest(filepath, default_fps=None, default_mode="dup"):
+    entries = [ ]
+    base = os.path.dirname(filepath)
+
+    with open(filepath, newline='') as f:
+        for row in csv.DictReader(f):
+            fps = row.get("fps") or default_fps
+            if fps is None: raise ValueError("no fps for " + row["input"] + " (add an fps column or pass -f)")
+            entries.append((os.path.join(base, row["input"]), os.path.join(base, row["output"]), parse_fps(fps), row.get("mode") or default_mode))
+
+    return entries
+
+# every .mp4 of directory, rendered with the same name in out_dir
+def scan_directory(directory, out_dir, fps, mode):
+    entries = [ ]
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".mp4"): continue
+        entries.append((os.path.join(directory, filename), os.path.join(out_dir, filename), fps, mode))
+
+    return entries
+
+# renders a job in the current (fresh) process: the output is written in <output>.part.mp4 and renamed when it is
+# complete, so a failed or killed job never leaves a truncated output. Module-level function, so it runs in a process pool
+def render_job(job, options):
+    tmp_path = part_path(job["output"])
+    if os.path.dirname(job["output"]): os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+
+    begin = time.perf_counter()
+    try:
+        stats = interpolation.render(job["input"], tmp_path, job["fps"], job["mode"], **options)
+        os.replace(tmp_path, job["output"])
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+    return {"frames_out": stats["frames"], "seconds": time.perf_counter() - begin}
+
+def part_path(filepath_out):
+    base, ext = os.path.splitext(filepath_out)
+    return base + ".part" + ext
+
+# ---- QUEUE ----
+
+# the jobs of a SQLite file (one row per output file, see SCHEMA): only the process running the queue writes the status
+# of the jobs, the renders report to it; WAL journal, so status can be read while the queue runs
+class JobQueue:
+    def __init__(self, db_path=BATCH_DB):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection: self.connection.execute(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # adds the (input, output, fps, mode) entries, reading the size and framerate of every input; an output already
+    # in the queue is skipped (so a manifest can be added again), an unreadable input is added as failed.
+    # returns the number of jobs added
+    def add(self, entries):
+        added = 0
+        with self.connection:
+            for filepath_in, filepath_out, fps, mode in entries:
+                if mode not in interpolation.MODES: raise ValueError("unknown interpolation mode: " + str(mode))
+                if os.path.abspath(filepath_in) == os.path.abspath(filepath_out): raise ValueError("the output would overwrite the input: " + filepath_in)
+
+                row = {"input": os.path.abspath(filepath_in), "output": os.path.abspath(filepath_out), "fps": str(parse_fps(fps)), "mode": mode, "added": time.time(),
+                       "width": None, "height": None, "fps_in": None, "frames_in": None, "status": "queued", "error": None}
+                try:
+                    size, fps_in, l_frames_in = read_video_info(filepath_in)
+                    row.update(width=size[0], height=size[1], fps_in=str(fps_in), frames_in=l_frames_in)
+                except Exception as e:
+                    row.update(status="failed", error="cannot read the input: " + str(e))
+
+                cursor = self.connection.execute("INSERT OR IGNORE INTO jobs (input, output, fps, mode, added, width, height, fps_in, frames_in, status, error) "
+                                                 "VALUES (:input, :output, :fps, :mode, :added, :width, :height, :fps_in, :frames_in, :status, :error)", row)
+                added += cursor.rowcount
+
+        return added
+
+    def jobs(self, status=None):
+        if status is None: return self.connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return self.connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+
+    # marks a queued job as running (atomically, so two queues on the same file never run the same job)
+    def claim(self, job_id, memory_mb):
+        with self.connection:
+            cursor = self.connection.execute("UPDATE jobs SET status = 'running', memory_mb = ?, host = ?, pid = ?, started = ?, attempts = attempts + 1, error = NULL "
+                                             "WHERE id = ? AND status = 'queued'", (memory_mb, socket.gethostname(), os.getpid(), time.time(), job_id))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, result):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'done', finished = ?, seconds = ?, frames_out = ? WHERE id = ?",
+                                    (time.time(), result["seconds"], result["frames_out"], job_id))
+
+    def fail(self, job_id, error):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?", (time.time(), error, job_id))
+
+    # puts back in the queue the given jobs (the ones that were running when the queue was stopped), or else
+    # the jobs left running by a queue of this machine that doesn't exist anymore (only checked on POSIX);
+    # with max_attempts, only the jobs started less than max_attempts times. returns the number of requeued jobs
+    def requeue(self, job_ids=None, max_attempts=None):
+        if job_ids is None:
+            if os.name != "posix": return 0
+            job_ids = [job["id"] for job in self.jobs("running") if job["host"] == socket.gethostname() and not process_alive(job["pid"])]
+
+        requeued = 0
+        with self.connection:
+            for job_id in job_ids:
+                requeued += self.connection.execute("UPDATE jobs SET status = 'queued' WHERE id = ? AND status = 'running' AND (? IS NULL OR attempts < ?)",
+                                                    (job_id, max_attempts, max_attempts)).rowcount
+
+        return requeued
+
+    # failed jobs back in the queue, with their attempts reset; returns their number
+    def retry(self):
+        with self.connection:
+            return self.connection.execute("UPDATE jobs SET status = 'queued', error = NULL, attempts = 0 WHERE status = 'failed'").rowcount
+
+    # number of jobs for every status, and throughput of the finished ones: output frames per second of render
+    # (summed over the jobs) and per second of wall-clock time (first start to last finish, so it includes the parallelism)
+    def stats(self):
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"): counts[row[0]] = row[1]
+
+        done = self.connection.execute("SELECT COUNT(*), SUM(frames_out), SUM(frames_in), SUM(seconds), MIN(started), MAX(finished) "
+                                       "FROM jobs WHERE status = 'done'").fetchone()
+        l_done, frames_out, frames_in, seconds, first, last = done
+        wall = (last - first) if l_done else 0.0
+
+        return {"jobs": counts,
+                "frames_out": frames_out or 0,
+                "frames_in": frames_in or 0,
+                "render_seconds": seconds or 0.0,
+                "wall_seconds": wall,
+                "job_fps": frames_out / seconds if seconds else 0.0,
+                "box_fps": frames_out / wall if wall else 0.0}
+
+def process_alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: return True
+    return True
+
+# ---- RUNNER ----
+
+# renders the queued jobs of queue on a pool of "jobs" processes (one fresh process per job, so the memory of a job
+# is given back when it ends): a job starts when a process is free and its estimated memory (see estimate_memory_mb,
+# with the workers of every job) fits in memory_mb together with the running ones; when the first queued job doesn't
+# fit, the smaller ones after it fill the free memory (a job larger than memory_mb runs alone).
+# options are passed to interpolation.render; memory_mb defaults to 80% of the physical memory (no limit if unknown)
+class BatchRunner:
+    def __init__(self, queue, jobs=None, memory_mb=None, log=print, max_attempts=MAX_ATTEMPTS, **options):
+        self.queue = queue
+        self.jobs = jobs or os.cpu_count() or 1
+        self.memory_mb = memory_mb if memory_mb is not None else physical_memory_mb() * 0.8
+        self.log = log
+        self.max_attempts = max_attempts
+        self.options = options
+
+        self.rendered = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def estimate(self, job):
+        if job["width"] is None: return BASE_MB                                # unreadable input, it fails at once
+        return estimate_memory_mb((job["width"], job["height"]), parse_fps(job["fps_in"]), parse_fps(job["fps"]), job["mode"],
+                                  self.options.get("workers", 1), self.options.get("bidirectional", False))
+
+    # jobs to start now: queued jobs, in order, that fit in the free processes and memory
+    def admit(self, running):
+        used = sum(memory for job, memory in running.values())
+        admitted = [ ]
+        for job in self.queue.jobs("queued"):
+            if len(running) + len(admitted) >= self.jobs: break
+            memory = self.estimate(job)
+            if self.memory_mb and used + memory > self.memory_mb and (running or admitted): continue
+            admitted.append((job, memory))
+            used += memory
+
+        return admitted
+
+    # runs until the queue is empty; stopping it (e.g. with Ctrl+C) puts the running jobs back in the queue.
+    # a render process killed from outside (e.g. by the out-of-memory killer) breaks the pool: the jobs that were running
+    # go back in the queue (they fail after max_attempts runs), and a new pool is started for the next ones
+    def run(self):
+        requeued = self.queue.requeue()
+        if requeued: self.log(str(requeued) + " jobs left running by a stopped queue put back in the queue")
+
+        running = { }                                                           # future -> (job, estimated memory)
+        pool = None
+        broken = False
+
+        try:
+            while True:
+                if pool is None or (broken and not running):
+                    if pool is not None: pool.shutdown()
+                    pool = self.new_pool()
+                    broken = False
+
+                if not broken:
+                    for job, memory in self.admit(running):
+                        if not self.queue.claim(job["id"], memory): continue
+                        self.log("job " + str(job["id"]) + " started: " + job["input"] + " -> " + job["output"] + " (" + job["mode"] + ", "
+                                 + job["fps"] + " fps, ~" + format(memory, ".0f") + " MB)")
+                        future = pool.submit(render_job, {"input": job["input"], "output": job["output"], "fps": job["fps"], "mode": job["mode"]}, self.options)
+                        running[future] = (job, memory)
+
+                if not running: break
+                for future in wait(running, return_when=FIRST_COMPLETED).done:
+                    if not self.collect(future, running.pop(future)[0]): broken = True
+        finally:
+            for future in running: future.cancel()
+            self.queue.requeue([job["id"] for job, memory in running.values()])
+            if pool is not None: pool.shutdown(cancel_futures=True)
+
+        return self.stats()
+
+    # one fresh process per job (spawned, so the parent's memory is not inherited)
+    def new_pool(self):
+        context = multiprocessing.get_context("spawn")
+        if sys.version_info >= (3, 11): return ProcessPoolExecutor(max_workers=self.jobs, mp_context=context, max_tasks_per_child=1)
+        return ProcessPoolExecutor(max_workers=self.jobs, mp_context=context)
+
+    # records the result of a job; returns False if the pool is broken
+    def collect(self, future, job):
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            if os.path.exists(part_path(job["output"])): os.remove(part_path(job["output"]))  # a killed render can't remove it
+            if self.queue.requeue([job["id"]], self.max_attempts):
+                self.requeued += 1
+                self.log("job " + str(job["id"]) + " queued again: the render process was killed")
+            else:
+                self.queue.fail(job["id"], "the render process was killed (out of memory?) in " + str(self.max_attempts) + " attempts")
+                self.failed += 1
+                self.log("job " + str(job["id"]) + " failed: the render process was killed " + str(self.max_attempts) + " times")
+            return False
+        except Exception as e:
+            self.queue.fail(job["id"], type(e).__name__ + ": " + str(e))
+            self.failed += 1
+            self.log("job " + str(job["id"]) + " failed: " + str(e))
+            return True
+
+        self.queue.finish(job["id"], result)
+        self.rendered += 1
+        self.log("job " + str(job["id"]) + " done: " + str(result["frames_out"]) + " frames in " + format(result["seconds"], ".1f") + " s ("
+                 + format(result["frames_out"] / result["seconds"] if result["seconds"] else 0.0, ".1f") + " fps)")
+        return True
+
+    def stats(self):
+        return {"rendered": self.rendered,
+                "failed": self.failed,
+                "requeued": self.requeued}
+
+# physical memory of the machine in MB, or 0 if it can't be read
+def physical_memory_mb():
+    try: return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1000000
+    except (AttributeError, ValueError, OSError): return 0
+
+# ---- COMMAND LINE ----
+
+def print_status(queue):
+    print(format("id", ">5") + "  " + format("status", "8") + format("mode", "10") + format("fps", ">10") + format("size", ">11")
+          + format("frames", ">8") + format("seconds", ">9") + format("fps out", ">9") + format("MB", ">7") + "  output")
+    for job in queue.jobs():
+        size = str(job["width"]) + "x" + str(job["height"]) if job["width"] else "?"
+        seconds = format(job["seconds"], ".1f") if job["seconds"] else ""
+        fps_out = format(job["frames_out"] / job["seconds"], ".1f") if job["seconds"] else ""
+        memory = format(job["memory_mb"], ".0f") if job["memory_mb"] else ""
+        print(format(job["id"], ">5") + "  " + format(job["status"], "8") + format(job["mode"], "10") + format(format(float(parse_fps(job["fps"])), ".6g"), ">10")
+              + format(size, ">11") + format(str(job["frames_out"] or ""), ">8") + format(seconds, ">9") + format(fps_out, ">9") + format(memory, ">7")
+              + "  " + job["output"] + (" (" + job["error"] + ")" if job["error"] else ""))
+
+    stats = queue.stats()
+    print(", ".join(str(n) + " " + status for status, n in stats["jobs"].items()) + "; "
+          + str(stats["frames_out"]) + " frames rendered in " + format(stats["render_seconds"], ".1f") + " s of render (" + format(stats["job_fps"], ".1f") + " fps per job), "
+          + format(stats["wall_seconds"], ".1f") + " s of wall-clock time (" + format(stats["box_fps"], ".1f") + " fps)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch", description="Batch rendering of many videos, with a job queue kept in a SQLite file")
+    parser.add_argument("--db", default=BATCH_DB, help="SQLite file of the job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add the .mp4 files of a directory, or the jobs of a csv manifest (columns input, output and optionally fps, mode)")
+    add.add_argument("source", help="directory or manifest")
+    add.add_argument("-o", "--out", help="output directory of the videos of a directory")
+    add.add_argument("-f", "--fps", type=parse_fps, help="output framerate (default of the manifest)")
+    add.add_argument("-m", "--mode", default="dup", choices=interpolation.MODES, help="interpolation mode (default of the manifest)")
+
+    run = commands.add_parser("run", help="render the queued jobs")
+    run.add_argument("-j", "--jobs", type=int, help="jobs rendered at the same time, each in its own process (default: the number of cores)")
+    run.add_argument("--max-attempts", default=MAX_ATTEMPTS, type=int, help="runs of a job whose render process is killed (e.g. out of memory) before it fails (default: %(default)s)")
+    run.add_argument("--memory", type=float, metavar="MB", help="memory for the running jobs, by their estimates (default: 80%% of the physical memory)")
+    run.add_argument("-w", "--workers", default=1, type=int, help="parallel workers of the mci of every job")
+    run.add_argument("-b", "--bidirectional", action="store_true", help="bidirectional mci")
+    run.add_argument("--flow-preset", default="quality", choices=FLOW_PRESETS, help="quality/speed preset of the optical flow estimation")
+    run.add_argument("--decoder", default="pyav", choices=DECODERS, help="decoding backend of the input videos")
+
+    commands.add_parser("status", help="print the jobs with their timing and throughput")
+    commands.add_parser("retry", help="put the failed jobs back in the queue")
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    queue = JobQueue(args.db)
+
+    try:
+        if args.command == "add":
+            if os.path.isdir(args.source):
+                if not (args.out and args.fps): raise SystemExit("a directory needs the output directory (-o) and the framerate (-f)")
+                entries = scan_directory(args.source, args.out, args.fps, args.mode)
+            else:
+                entries = read_manifest(args.source, args.fps, args.mode)
+            print(str(queue.add(entries)) + " jobs added (" + str(len(entries)) + " in " + args.source + ")")
+        elif args.command == "run":
+            runner = BatchRunner(queue, args.jobs, args.memory, max_attempts=args.max_attempts, workers=args.workers, bidirectional=args.bidirectional,
+                                 flow_options=dict(FLOW_PRESETS[args.flow_preset]), decoder=args.decoder)
+            stats = runner.run()
+            print(str(stats["rendered"]) + " jobs rendered, " + str(stats["failed"]) + " failed"
+                  + (", " + str(stats["requeued"]) + " queued again after a killed render" if stats["requeued"] else ""))
+            print_status(queue)
+        elif args.command == "status":
+            print_status(queue)
+        elif args.command == "retry":
+            print(str(queue.retry()) + " failed jobs queued again")
+    finally:
+        queue.close()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc reproducible benchmark of the interpolation modes: throughput, time of every stage and peak memory, saved as json
+ #       python benchmark.py --out bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try: import resource                                                            # POSIX only
+except ImportError: resource = None
+
+import numpy as np
+import cv2
+
+import interpolation
+import profiling
+from decoder import DECODERS
+from flow import OpticalFlow, flow_to_map
+
+RESOLUTIONS = ((320, 240), (1280, 720), (1920, 1080))
+MULTIPLIERS = (2, 4, 6, 12)
+BENCH_MODES = ("dup", "blend", "farneback", "lk", "reduce")
+CLIPS = ("test/ball.mp4", "test/asahi.mp4")
+SYNTHETIC_FPS = 10
+
+# ---- SYNTHETIC CLIPS ----
+
+# deterministic synthetic clip: a textured background with a ball and a rectangle moving at different speeds
+def synthetic_frame(size, i):
+    w, h = size
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:,np.newaxis]
+    frame = np.empty((h, w, 3), dtype=np.uint8)
+    frame[...,0] = x / 2 + 64
+    frame[...,1] = y / 2 + 64
+    frame[...,2] = ((np.sin(x/8 + i/5) + np.cos(y/8)) * 32 + 128)
+
+    r = max(4, h//10)
+    cv2.circle(frame, (int(r + (w-2*r) * (i % 40) / 40), h//3), r, (0, 0, 255), -1)
+    cv2.rectangle(frame, (w//2 - r + 3*i % (w//2), 2*h//3 - r), (w//2 + r + 3*i % (w//2), 2*h//3 + r), (255, 255, 255), -1)
+
+    return frame
+
+def generate_synthetic_clip(directory, size, l_frames):
+    filepath = os.path.join(directory, "synthetic_" + str(size[0]) + "x" + str(size[1]) + ".mp4")
+    interpolation.write_video((synthetic_frame(size, i) for i in range(l_frames)), filepath, SYNTHETIC_FPS, size)
+
+    return filepath
+
+# ---- CASES ----
+
+def frames_of(filepath, l_frames, decoder="pyav"):
+    return interpolation.read_video(filepath, 0, l_frames, decoder)
+
+def pipeline(frames_in, l_frames_in, mode, fps_in, fps_out, bidirectional):
+    times = interpolation.frame_times(fps_in, fps_out, l_frames_in)
+    if mode == "reduce": return interpolation.gen_reduced_out(frames_in, l_frames_in, times)
+
+    if mode == "dup": return interpolation.dup(frames_in, l_frames_in, times)
+    elif mode == "blend": return interpolation.blend(frames_in, l_frames_in, times)
+    elif mode == "farneback": return interpolation.mci(frames_in, l_frames_in, times, "GF", bidirectional=bidirectional)
+    elif mode == "lk": return interpolation.mci(frames_in, l_frames_in, times, "LK", bidirectional=bidirectional)
+
+# peak resident memory of this process, in MB, or None where it can't be read (Windows)
+def peak_rss_mb():
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1000000 if sys.platform == "darwin" else rss / 1000                  # bytes on macOS, KB on Linux
+
+# runs a single case in the current (fresh) process: first the whole streaming render, whose peak memory is recorded
+# and whose stages are measured by the profiler, then every stage on its own (decode, flow, remap, encode)
+def run_case(filepath, l_frames, mode, multiplier, bidirectional=False, decoder="pyav"):
+    size, fps_in, l_frames_in = interpolation.read_video_info(filepath, decoder)
+    l_frames_in = min(l_frames, l_frames_in)
+    fps_out = fps_in * multiplier if mode != "reduce" else fps_in / multiplier
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "out.mp4")
+
+        profiling.enable()
+        start = time.perf_counter()
+        encoder_stats = interpolation.write_video(pipeline(frames_of(filepath, l_frames_in, decoder), l_frames_in, mode, fps_in, fps_out, bidirectional), output, fps_out, size)
+        seconds = time.perf_counter() - start
+        peak = peak_rss_mb()
+        pipeline_stages = profiling.disable().report()
+
+        stages = { }
+
+        start = time.perf_counter()
+        frames = list(frames_of(filepath, l_frames_in, decoder))
+        stages["decode"] = time.perf_counter() - start
+
+        if mode in ("farneback", "lk"):
+            estimator = OpticalFlow("GF" if mode == "farneback" else "LK")
+            flows = [ ]
+            start = time.perf_counter()
+            for anchor, target in zip(frames, frames[1:]): flows.append(estimator(anchor, target))
+            stages["flow"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for anchor, flow in zip(frames, flows): cv2.remap(anchor, flow_to_map(flow), None, cv2.INTER_LINEAR)
+            stages["remap"] = time.perf_counter() - start
+            del flows
+
+        repeat = multiplier if mode != "reduce" else 1
+        start = time.perf_counter()
+        output_video = interpolation.generate_video(os.path.join(directory, "encode.mp4"), fps_out, size)
+        for f in frames:
+            for _ in range(repeat): output_video.write(f)
+        output_video.release()
+        stages["encode"] = time.perf_counter() - start
+
+    return {"clip": filepath,
+            "resolution": list(size),
+            "frames_in": l_frames_in,
+            "mode": mode,
+            "multiplier": multiplier,
+            "bidirectional": bidirectional,
+            "decoder": decoder,
+            "frames_out": encoder_stats["frames"],
+            "seconds": seconds,
+            "fps": encoder_stats["frames"] / seconds if seconds else 0.0,
+            "input_fps": l_frames_in / seconds if seconds else 0.0,
+            "stages": stages,
+            "pipeline_stages": pipeline_stages,
+            "stage_pairs": max(0, l_frames_in - 1),
+            "encoder": encoder_stats,
+            "peak_rss_mb": peak}
+
+# every case runs in its own spawned process, so that its peak memory isn't affected by the previous ones
+def run_isolated(*case):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, *case).result()
+
+def environment():
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "opencv_threads": cv2.getNumThreads()}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the interpolation modes (throughput, stage times, peak memory)")
+    parser.add_argument("--out", help="json file of the results (printed on stdout if not given)")
+    parser.add_argument("--modes", nargs="+", default=BENCH_MODES, choices=BENCH_MODES)
+    parser.add_argument("--multipliers", nargs="+", type=int, default=MULTIPLIERS)
+    parser.add_argument("--resolutions", nargs="+", default=[str(w) + "x" + str(h) for w, h in RESOLUTIONS], help="resolutions of the synthetic clips, e.g. 1920x1080")
+    parser.add_argument("--clips", nargs="*", default=CLIPS, help="real clips to benchmark besides the synthetic ones")
+    parser.add_argument("--frames", type=int, default=20, help="input frames of every case")
+    parser.add_argument("--bidirectional", action="store_true", help="bidirectional mci")
+    parser.add_argument("--decoder", default="pyav", choices=DECODERS, help="decoding backend of the clips")
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {"environment": environment(), "frames": args.frames, "cases": [ ]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        clips = [ ]
+        for resolution in args.resolutions:
+            size = tuple(int(v) for v in resolution.split("x"))
+            clips.append(generate_synthetic_clip(directory, size, args.frames))
+        clips += [clip for clip in args.clips if os.path.exists(clip)]
+
+        for clip in clips:
+            for mode in args.modes:
+                for multiplier in args.multipliers:
+                    case = run_isolated(clip, args.frames, mode, multiplier, args.bidirectional, args.decoder)
+                    if clip.startswith(directory): case["clip"] = os.path.basename(clip)
+                    results["cases"].append(case)
+
+                    sys.stderr.write(case["clip"] + " " + mode + " x" + str(multiplier) + ": " + format(case["fps"], ".1f") + " fps, "
+                                     + (format(case["peak_rss_mb"], ".0f") + " MB" if case["peak_rss_mb"] is not None else "peak memory unknown") + "\n")
+
+    report = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f: f.write(report)
+    else: print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc preallocated buffers, to keep memory allocations out of the per-frame loop:
+ #       a pool of output frames and per-thread work buffers (gray frames, flows, coordinate maps...)
+"""
+import threading
+
+import numpy as np
+
+# pool of preallocated uint8 frames, all with the same shape (allocated in a single block on the first acquire):
+# the interpolators write the missing frames into acquired frames, and the encoder gives them back with release()
+# once they are encoded, so in the steady state no frame is allocated.
+# if all the frames are in use, acquire() returns a new frame that doesn't belong to the pool (so it never blocks
+# and consumers that don't release their frames keep working); a pooled frame must be yielded only once,
+# since it can be overwritten as soon as it is released
+class FramePool:
+    def __init__(self, count):
+        self.count = count
+        self.shape = None
+        self.frames = [ ]
+        self.index = { }                                                        # id of a pooled frame -> its position
+        self.free = [ ]
+        self.lock = threading.Lock()
+
+    def acquire(self, shape):
+        with self.lock:
+            if self.shape != shape: self.allocate(shape)
+            if self.free: return self.frames[self.free.pop()]
+
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, frame):
+        with self.lock:
+            i = self.index.get(id(frame))
+            if i is not None and self.frames[i] is frame and i not in self.free: self.free.append(i)
+
+    def allocate(self, shape):
+        block = np.empty((self.count,) + tuple(shape), dtype=np.uint8)
+        self.shape = shape
+        self.frames = list(block)
+        self.index = {id(frame): i for i, frame in enumerate(self.frames)}
+        self.free = list(range(self.count))
+
+# new output frame, from the pool if there is one
+def new_frame(pool, shape):
+    if pool is None: return np.empty(shape, dtype=np.uint8)
+    return pool.acquire(shape)
+
+# work buffers reused from one frame to the next, by name and shape; every thread has its own ones,
+# so the workers of a thread pool never share them. A buffer is valid only until the next get() with the same name
+class Workspace(threading.local):
+    def __init__(self):
+        self.buffers = { }
+
+    def get(self, name, shape, dtype=np.float32):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = np.empty(shape, dtype=dtype)
+
+        return buffer
+
+workspace = Workspace()
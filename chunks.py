@@ -0,0 +1,303 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc chunked, resumable rendering: the output is rendered in segments (one file each, also by several processes
+ #       or by several machines sharing the work directory), which are then concatenated without re-encoding
+"""
+import json
+import math
+import os
+import shutil
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import av
+
+import interpolation
+from interpolation import Cancelled, no_progress, normalize, parse_fps, read_video_info
+
+MANIFEST = "manifest.json"
+CONCAT_LOCK = "concat.lock"
+RUNTIME_OPTIONS = ("workers", "processes", "decode_threads", "frame_store")     # options of render that don't change the output
+
+# ---- SEGMENTS ----
+
+# renders the output frames between the source frames start and stop (see interpolation.render) in segment_path;
+# the file appears only when it is complete, and not at all if no output frame falls in the segment
+# (shorter than the output frame interval: its statistics have "frames": 0). Returns its statistics, with the scene cuts and the choices of the auto mode
+# of the segment (module-level function, so it can run in a process pool)
+def render_segment(filepath_in, segment_path, fps_out, mode, start, stop, options, progress=no_progress, cancel=None):
+    tmp_path = os.path.splitext(segment_path)[0] + ".tmp.mp4"
+    scene_cut, selector = options.get("scene_cut"), options.get("selector")
+    if scene_cut is not None: scene_cut.cuts = [ ]
+    if selector is not None: selector.choices = [ ]
+
+    begin = time.perf_counter()
+    stats = interpolation.render(filepath_in, tmp_path, fps_out, mode, progress, cancel=cancel, start=start, stop=stop, **options)
+    if stats["frames"] > 0: os.replace(tmp_path, segment_path)
+    elif os.path.exists(tmp_path): os.remove(tmp_path)
+
+    return {"start": start,
+            "stop": stop,
+            "frames": stats["frames"],
+            "seconds": time.perf_counter() - begin,
+            "host": socket.gethostname(),
+            "cuts": scene_cut.cuts if scene_cut is not None else [ ],
+            "choices": selector.choices if selector is not None else [ ]}
+
+# concatenates the segments (same codec, size and framerate) in filepath_out by copying their packets, shifted in time
+def concatenate(segment_paths, filepath_out):
+    base, ext = os.path.splitext(filepath_out)
+    tmp_path = base + ".tmp" + ext
+    output = av.open(tmp_path, "w")
+    stream = None
+    offset = 0
+
+    try:
+        for path in segment_paths:
+            with av.open(path) as segment:
+                source = segment.streams.video[0]
+                if stream is None:
+                    if hasattr(output, "add_stream_from_template"): stream = output.add_stream_from_template(source)
+                    else: stream = output.add_stream(template=source)            # PyAV < 14
+
+                end = offset
+                for packet in segment.demux(source):
+                    if packet.dts is None: continue                             # empty packet at the end of the stream
+                    if packet.pts is not None: packet.pts += offset
+                    packet.dts += offset
+                    end = max(end, (packet.pts if packet.pts is not None else packet.dts) + packet.duration)
+                    packet.stream = stream
+                    output.mux(packet)
+                offset = end
+    finally:
+        output.close()
+
+    os.replace(tmp_path, filepath_out)
+
+# ---- JOB ----
+
+# the settings that change the output, saved in the manifest: a work directory of another job is never resumed
+# (the flow cache, the number of workers... don't matter, so several machines can share the same job)
+def job_settings(options):
+    settings = { }
+    for name, value in options.items():
+        if name in RUNTIME_OPTIONS: continue
+        if isinstance(value, (bool, int, float, str, type(None))): settings[name] = value
+        elif name == "flow_options": settings[name] = {k: v for k, v in value.items() if k != "cache"}
+        elif name in ("scene_cut", "selector"): settings[name] = {k: v for k, v in vars(value).items() if isinstance(v, (bool, int, float, str))}
+
+    return settings
+
+# the output of filepath_in is split in segments of segment_seconds, rendered one by one (or by a pool of jobs processes)
+# in work_dir (by default <filepath_out>.parts) and concatenated in filepath_out when all of them are done.
+# every segment covers the source frames [start, stop) and also decodes the frame stop (one frame of overlap),
+# so the missing frames across the border of two segments are interpolated as in a single render.
+# the manifest (work_dir/manifest.json) keeps the job and its segments; a finished segment has its segment_NNNN.json,
+# a segment being rendered its segment_NNNN.lock (taken atomically, so processes and machines sharing work_dir
+# never render the same segment; the locks left by a killed process of this machine are taken over).
+# running the same job again skips the finished segments; options are passed to interpolation.render
+class ChunkedRender:
+    def __init__(self, filepath_in, filepath_out, fps_out, mode, segment_seconds=10, work_dir=None, jobs=1, keep_segments=False, **options):
+        if mode not in interpolation.MODES: raise ValueError("unknown interpolation mode: " + str(mode))
+        if segment_seconds <= 0: raise ValueError("segment_seconds must be positive")
+
+        self.filepath_in = filepath_in
+        self.filepath_out = filepath_out
+        self.fps_out = parse_fps(fps_out)
+        self.mode = mode
+        self.segment_seconds = segment_seconds
+        self.work_dir = work_dir or filepath_out + ".parts"
+        self.jobs = jobs
+        self.keep_segments = keep_segments
+        self.options = options
+
+        self.rendered = 0
+        self.skipped = 0
+        self.busy = 0                                                           # segments being rendered by other processes
+        self.concatenating = False                                              # output being written by another process
+
+    def path(self, k, ext):
+        return os.path.join(self.work_dir, "segment_" + format(k, "04d") + ext)
+
+    # segments of the job: the ones of the manifest if it is the same job, else a new plan (the files of the old job are removed)
+    def plan(self):
+        size, fps_in, l_frames_in = read_video_info(self.filepath_in, self.options.get("decoder", "pyav"), self.options.get("frame_store"))
+        segment_frames = max(1, math.ceil(self.segment_seconds * fps_in))
+        job = {"input": os.path.basename(self.filepath_in),
+               "input_size": os.path.getsize(self.filepath_in),
+               "frames_in": l_frames_in,
+               "fps_out": str(self.fps_out),
+               "mode": self.mode,
+               "settings": job_settings(self.options)}
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        manifest_path = os.path.join(self.work_dir, MANIFEST)
+        try:
+            with open(manifest_path) as f: manifest = json.load(f)
+            if manifest["job"] == json.loads(json.dumps(job)): return l_frames_in, manifest["segments"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        for name in os.listdir(self.work_dir):
+            if name.startswith("segment_"): os.remove(os.path.join(self.work_dir, name))
+
+        segments = [[start, min(start + segment_frames, l_frames_in)] for start in range(0, l_frames_in, segment_frames)]
+        tmp_path = manifest_path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, "w") as f: json.dump({"job": job, "segments": segments}, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+        return l_frames_in, segments
+
+    # finished segment: its json and its file, or just the json of a segment without output frames
+    def done(self, k):
+        if not os.path.exists(self.path(k, ".json")): return False
+        if os.path.exists(self.path(k, ".mp4")): return True
+
+        try:
+            with open(self.path(k, ".json")) as f: return json.load(f)["frames"] == 0
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def claim(self, k):
+        if not self.lock(self.path(k, ".lock")): return False
+        if self.done(k):                                                        # finished by someone else in the meantime
+            self.release(k)
+            return False
+
+        return True
+
+    # takes lock_path atomically (O_EXCL), or takes over the stale lock of a killed process; False if it is held
+    def lock(self, lock_path):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self.stale(lock_path): return False
+            try: os.remove(lock_path)
+            except OSError: return False
+            return self.lock(lock_path)
+
+        with os.fdopen(fd, "w") as f: json.dump({"host": socket.gethostname(), "pid": os.getpid()}, f)
+        return True
+
+    # lock of a process of this machine that doesn't exist anymore (only checked on POSIX, where signal 0 doesn't kill)
+    def stale(self, lock_path):
+        if os.name != "posix": return False
+        try:
+            with open(lock_path) as f: lock = json.load(f)
+        except (OSError, ValueError):
+            return False                                                        # being written
+        if lock.get("host") != socket.gethostname(): return False
+
+        try: os.kill(lock["pid"], 0)
+        except ProcessLookupError: return True
+        except OSError: return False
+        return False
+
+    def release(self, k):
+        try: os.remove(self.path(k, ".lock"))
+        except OSError: pass
+
+    def finish(self, k, result):
+        tmp_path = self.path(k, ".json.tmp")
+        with open(tmp_path, "w") as f: json.dump(result, f)
+        os.replace(tmp_path, self.path(k, ".json"))
+        self.release(k)
+        self.rendered += 1
+
+    # renders the segments not done yet, then concatenates them if all of them are done.
+    # cancel (a threading.Event) stops the job between two segments (or inside the segment, without a pool):
+    # the finished segments are kept, so it can be resumed
+    def run(self, progress=no_progress, cancel=None):
+        l_frames_in, segments = self.plan()
+        todo = [ ]
+        for k, segment in enumerate(segments):
+            if self.done(k): self.skipped += 1
+            else: todo.append(k)
+
+        if self.jobs > 1: self.run_pool(todo, segments, l_frames_in, progress, cancel)
+        else:
+            for k in todo:
+                if not self.claim(k):
+                    self.busy += 1
+                    continue
+                start, stop = segments[k]
+                try:
+                    result = render_segment(self.filepath_in, self.path(k, ".mp4"), self.fps_out, self.mode, start, stop, self.options,
+                                            lambda value: progress(min(value, 99)), cancel)
+                except BaseException:
+                    self.release(k)
+                    raise
+                self.finish(k, result)
+
+        return self.complete(segments, progress)
+
+    def run_pool(self, todo, segments, l_frames_in, progress, cancel):
+        running = { }
+
+        def collect(futures):
+            for future in futures:
+                k = running.pop(future)
+                try: self.finish(k, future.result())
+                except BaseException:
+                    self.release(k)
+                    raise
+                progress(min(normalize(segments[k][1], 0, l_frames_in), 99))
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            try:
+                for k in todo:
+                    while len(running) >= self.jobs: collect(wait(running, return_when=FIRST_COMPLETED).done)
+                    if cancel is not None and cancel.is_set(): raise Cancelled()
+                    if not self.claim(k):
+                        self.busy += 1
+                        continue
+                    start, stop = segments[k]
+                    running[pool.submit(render_segment, self.filepath_in, self.path(k, ".mp4"), self.fps_out, self.mode, start, stop, self.options)] = k
+
+                collect(wait(running).done)
+            finally:
+                for future, k in running.items():                               # cancelled or failed: the other segments are not done
+                    future.cancel()
+                    self.release(k)
+
+    # concatenates the segments with output frames when all of them are done, and merges their scene cuts and auto
+    # choices in the options. Only the process holding work_dir/concat.lock writes the output and removes the work
+    # directory: another process that finishes its last segment at the same time returns False (see concatenating)
+    def complete(self, segments, progress):
+        if not all(self.done(k) for k in range(len(segments))): return False
+
+        lock_path = os.path.join(self.work_dir, CONCAT_LOCK)
+        if not self.lock(lock_path):
+            self.concatenating = True
+            return False
+
+        try:
+            results = [ ]
+            for k in range(len(segments)):
+                with open(self.path(k, ".json")) as f: results.append(json.load(f))
+
+            segment_paths = [self.path(k, ".mp4") for k, result in enumerate(results) if result["frames"] > 0]
+            if not segment_paths: raise ValueError("no output frames: the output framerate is too low for the duration of the input")
+
+            scene_cut, selector = self.options.get("scene_cut"), self.options.get("selector")
+            if scene_cut is not None: scene_cut.cuts = [cut for result in results for cut in result["cuts"]]
+            if selector is not None: selector.choices = [tuple(choice) for result in results for choice in result["choices"]]
+
+            concatenate(segment_paths, self.filepath_out)
+        except BaseException:
+            os.remove(lock_path)
+            raise
+
+        if self.keep_segments: os.remove(lock_path)
+        else: shutil.rmtree(self.work_dir, ignore_errors=True)
+        progress(100)
+
+        return True
+
+    def stats(self):
+        return {"rendered": self.rendered,
+                "skipped": self.skipped,
+                "busy": self.busy,
+                "concatenating": self.concatenating}
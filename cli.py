@@ -0,0 +1,130 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc headless command-line entry point (no Qt import): python -m cli -i input.mp4 -o output.mp4 -f 60 -m blend
+"""
+import argparse
+import sys
+
+import interpolation
+import profiling
+from flow import FLOW_PRESETS
+from adaptive import ModeSelector
+from chunks import ChunkedRender
+from decoder import DECODERS
+from flowcache import FlowCache
+from framestore import FrameStore
+from scenecut import CUT_FALLBACKS, CUT_METHODS, SceneCutDetector
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Video frame interpolator (headless)")
+    parser.add_argument("-i", "--input", required=True, help="input video file")
+    parser.add_argument("-o", "--output", required=True, help="output video file (.mp4)")
+    parser.add_argument("-f", "--fps", required=True, type=interpolation.parse_fps, help="framerate of the output video (e.g. 60, 59.94 or 60000/1001)")
+    parser.add_argument("-m", "--mode", default="dup", choices=interpolation.MODES, help="interpolation mode (ignored when reducing the framerate)")
+    parser.add_argument("-w", "--workers", default=1, type=int, help="number of parallel workers for the mci modes")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads for the parallel mci")
+    parser.add_argument("-b", "--bidirectional", action="store_true", help="mci with one forward and one backward flow per pair of frames, warped by temporal position")
+    parser.add_argument("--decoder", default="pyav", choices=DECODERS, help="decoding backend of the input video")
+    parser.add_argument("--decode-threads", default=0, type=int, help="decoding threads (0: chosen by the decoder)")
+    parser.add_argument("--frame-store", metavar="DIR", help="keep the decoded frames in a memory-mapped file in this directory, so the next runs on the same input skip the decoding")
+    parser.add_argument("--tile", default=0, type=int, metavar="PIXELS", help="compensate the frames in tiles of this size, in parallel on the workers (for 4K/8K input; 0 disables it)")
+    parser.add_argument("--tile-margin", default=64, type=int, metavar="PIXELS", help="context around every tile, larger than the fastest motion (hides the seams)")
+    parser.add_argument("--lk-grid", default=8, type=int, help="spacing in pixel of the points tracked by Lucas-Kanade (1 tracks every pixel)")
+    parser.add_argument("--flow-preset", default="quality", choices=FLOW_PRESETS, help="quality/speed preset of the optical flow estimation")
+    parser.add_argument("--flow-scale", type=float, help="resolution at which the optical flow is estimated (e.g. 0.5, 0.25), overrides the preset")
+    parser.add_argument("--flow-warm-start", action="store_true", help="start every Farneback flow from the one of the previous pair, with less levels and iterations (single worker only)")
+    parser.add_argument("--flow-cache", metavar="DIR", help="directory of the optical flow cache (disabled if not given)")
+    parser.add_argument("--flow-cache-size", default=1024, type=int, metavar="MB", help="maximum size of the optical flow cache")
+    parser.add_argument("--auto-dup-threshold", default=0.002, type=float, help="auto mode: mean absolute difference in [0,1] up to which a pair is duplicated")
+    parser.add_argument("--auto-blend-threshold", default=1.0, type=float, help="auto mode: motion in pixel below which a pair is blended instead of motion compensated")
+    parser.add_argument("--auto-report", metavar="FILE", help="auto mode: save the mode chosen for every pair of source frames (csv)")
+    parser.add_argument("--scene-cut", choices=CUT_METHODS, help="detect the scene cuts (color histograms or mean absolute difference) and don't run the mci across them")
+    parser.add_argument("--scene-cut-threshold", type=float, help="score in [0,1] above which a pair of frames is a cut (default: " + ", ".join(m + " " + str(t) for m, t in CUT_METHODS.items()) + ")")
+    parser.add_argument("--scene-cut-fallback", default="dup", choices=CUT_FALLBACKS, help="mode of the missing frames across a cut")
+    parser.add_argument("--chunk-seconds", type=float, help="render in segments of this duration, resumable (the finished segments are skipped when the command is run again)")
+    parser.add_argument("--chunk-dir", metavar="DIR", help="work directory of the segments, can be shared by several machines (default: <output>.parts)")
+    parser.add_argument("--chunk-jobs", default=1, type=int, help="segments rendered at the same time, each in its own process")
+    parser.add_argument("--keep-chunks", action="store_true", help="keep the work directory after the concatenation")
+    parser.add_argument("--profile", metavar="FILE", help="save the time of every stage of the pipeline (json)")
+    parser.add_argument("--trace", metavar="FILE", help="save a Chrome trace of the stages of the pipeline (chrome://tracing)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the progress")
+
+    return parser.parse_args(argv)
+
+# prints the progress on stderr only when the percentage changes
+def print_progress():
+    last = -1
+
+    def progress(value):
+        nonlocal last
+        if value != last:
+            last = value
+            sys.stderr.write("\r" + str(value) + "%")
+            if value == 100: sys.stderr.write("\n")
+            sys.stderr.flush()
+
+    return progress
+
+def main(argv=None):
+    args = parse_args(argv)
+    progress = interpolation.no_progress if args.quiet else print_progress()
+
+    cache = FlowCache(args.flow_cache, args.flow_cache_size) if args.flow_cache else None
+    flow_options = dict(FLOW_PRESETS[args.flow_preset], lk_grid=args.lk_grid, cache=cache)
+    if args.flow_scale: flow_options["scale"] = args.flow_scale
+    if args.flow_warm_start: flow_options["warm_start"] = True
+
+    selector = ModeSelector(args.auto_dup_threshold, args.auto_blend_threshold) if args.mode == "auto" else None
+    scene_cut = SceneCutDetector(args.scene_cut, args.scene_cut_threshold, args.scene_cut_fallback) if args.scene_cut else None
+
+    if args.profile or args.trace: profiling.enable(trace=bool(args.trace))
+
+    options = dict(workers=args.workers, processes=args.processes, bidirectional=args.bidirectional, flow_options=flow_options,
+                   scene_cut=scene_cut, selector=selector, tile_size=args.tile, tile_margin=args.tile_margin,
+                   decoder=args.decoder, decode_threads=args.decode_threads, frame_store=FrameStore(args.frame_store) if args.frame_store else None)
+
+    if args.chunk_seconds:
+        job = ChunkedRender(args.input, args.output, args.fps, args.mode, args.chunk_seconds, args.chunk_dir, args.chunk_jobs, args.keep_chunks, **options)
+        complete = job.run(progress)
+        stats = job.stats()
+        if not args.quiet:
+            sys.stderr.write("segments: " + str(stats["rendered"]) + " rendered, " + str(stats["skipped"]) + " already done, "
+                             + str(stats["busy"]) + " being rendered by other processes; "
+                             + ("output written in " + args.output if complete
+                                else "output being written by another process" if stats["concatenating"]
+                                else "output not complete yet, run again to resume") + "\n")
+        if not complete: return 1
+    else:
+        encoder_stats = interpolation.render(args.input, args.output, args.fps, args.mode, progress, **options)
+
+    if not args.quiet and not args.chunk_seconds:
+        sys.stderr.write("encoder: " + str(encoder_stats["frames"]) + " frames, " + format(encoder_stats["encoder_fps"], ".1f") + " fps, "
+                         + "max queue depth " + str(encoder_stats["max_queue_depth"]) + "/" + str(encoder_stats["queue_size"]) + ", "
+                         + format(encoder_stats["wait_time"], ".2f") + " s waiting for the encoder\n")
+    if cache is not None and not args.quiet:
+        stats = cache.stats()
+        lookups = str(stats["hits"]) + " hits, " + str(stats["misses"]) + " misses (hit rate " + format(stats["hit_rate"], ".1%") + "), "
+        if args.processes or (args.chunk_seconds and args.chunk_jobs > 1): lookups = ""   # counted by the other processes, not here
+        sys.stderr.write("flow cache: " + lookups + str(stats["files"]) + " files, " + format(stats["size_mb"], ".1f") + " MB\n")
+
+    if selector is not None:
+        counts = selector.counts()
+        if not args.quiet:
+            sys.stderr.write("auto: " + ", ".join(mode + " " + str(n) for mode, n in counts.items()) + " pairs\n")
+        if args.auto_report:
+            with open(args.auto_report, "w") as f:
+                f.write("frame,mode\n")
+                for index, mode in selector.choices: f.write(str(index) + "," + mode + "\n")
+    if scene_cut is not None and not args.quiet:
+        sys.stderr.write("scene cuts: " + str(len(scene_cut.cuts)) + (" (before source frames " + ", ".join(str(c) for c in scene_cut.cuts) + ")" if scene_cut.cuts else "")
+                         + ", filled with " + scene_cut.fallback + "\n")
+
+    profiler = profiling.disable()
+    if args.profile: profiler.dump_json(args.profile)
+    if args.trace: profiler.dump_chrome_trace(args.trace)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc decoding backends: PyAV (threaded decoding, BGR or gray frames straight out of the decoder, seeking),
+ #       cv2.VideoCapture and pims (the original reader, RGB frames converted to BGR)
+"""
+from fractions import Fraction
+
+import av
+import numpy as np
+import cv2
+
+from profiling import profile
+
+DECODERS = ("pyav", "opencv", "pims")
+
+# every reader has info(), which returns (size, framerate as a Fraction, number of frames) without decoding the video,
+# and frames(start, stop, gray), a generator of the frames from start to stop (excluded) as BGR (or gray, if gray is True)
+# uint8 arrays: the frames before start are skipped by seeking, when the backend can; threads is the number of decoding
+# threads (0: chosen by the decoder)
+
+# PyAV: the frames are converted from YUV to BGR (or just their luma plane is copied, for gray) by libswscale
+# while they leave the decoder, without the RGB copy and the cvtColor of pims; opening doesn't index the file
+class PyAVReader:
+    def __init__(self, filepath, threads=0):
+        self.filepath = filepath
+        self.threads = threads
+
+    def info(self):
+        with av.open(self.filepath) as container:
+            stream = container.streams.video[0]
+            fps = Fraction(stream.average_rate or stream.guessed_rate)
+            l_frames = stream.frames
+            if not l_frames and stream.duration:                                # not in the header: estimated from the duration
+                l_frames = round(stream.duration * stream.time_base * fps)
+            if not l_frames:                                                    # neither of them (e.g. mkv, webm): counts the packets,
+                l_frames = sum(1 for packet in container.demux(stream) if packet.size)  # demuxed without decoding them
+            if not l_frames: raise ValueError("no video frames in " + self.filepath)
+
+            return (stream.codec_context.width, stream.codec_context.height), fps, l_frames
+
+    def frames(self, start=0, stop=None, gray=False):
+        container = av.open(self.filepath)
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"                                         # frame and slice threads
+            stream.thread_count = self.threads
+            fps = Fraction(stream.average_rate or stream.guessed_rate)
+            origin = stream.start_time or 0
+            fmt = "gray" if gray else "bgr24"
+
+            if start > 0:                                                       # to the keyframe before start, then decodes up to it
+                container.seek(origin + int(start / fps / stream.time_base), stream=stream, backward=True)
+
+            decoded = container.decode(stream)
+            i = start
+            while stop is None or i < stop:
+                with profile("decode"): frame = next(decoded, None)
+                if frame is None: break
+                if frame.pts is not None: i = round((frame.pts - origin) * stream.time_base * fps)
+                if i < start:
+                    i = i + 1
+                    continue
+                with profile("convert"): frame = frame.to_ndarray(format=fmt)
+                yield frame
+                i = i + 1
+        finally:
+            container.close()
+
+# cv2.VideoCapture: frames already in BGR; seeks with CAP_PROP_POS_FRAMES
+class OpenCVReader:
+    def __init__(self, filepath, threads=0):
+        self.filepath = filepath
+        self.threads = threads
+
+    def open(self):
+        if self.threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+            return cv2.VideoCapture(self.filepath, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, self.threads])
+        return cv2.VideoCapture(self.filepath)
+
+    def info(self):
+        capture = self.open()
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        fps = Fraction(capture.get(cv2.CAP_PROP_FPS)).limit_denominator(1001)
+        l_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+
+        return size, fps, l_frames
+
+    def frames(self, start=0, stop=None, gray=False):
+        capture = self.open()
+        try:
+            if start > 0: capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            i = start
+            while stop is None or i < stop:
+                with profile("decode"): ret, frame = capture.read()
+                if not ret: break
+                if gray:
+                    with profile("convert"): frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                yield frame
+                i = i + 1
+        finally:
+            capture.release()
+
+# pims (the original reader): indexes the file when it is opened, RGB frames converted to BGR (threads is ignored).
+# pims is imported only when it is used, so the other backends work without it
+class PimsReader:
+    def __init__(self, filepath, threads=0):
+        self.filepath = filepath
+
+    def video(self):
+        import pims
+        return pims.Video(self.filepath)
+
+    def info(self):
+        frames_rgb = self.video()
+        size = (frames_rgb.frame_shape[1],frames_rgb.frame_shape[0])
+        info = size, Fraction(frames_rgb.frame_rate).limit_denominator(1001), len(frames_rgb)
+
+        del[frames_rgb]
+
+        return info
+
+    def frames(self, start=0, stop=None, gray=False):
+        frames_rgb = iter(self.video())
+        code = cv2.COLOR_RGB2GRAY if gray else cv2.COLOR_RGB2BGR
+        i = 0
+
+        while stop is None or i < stop:
+            with profile("decode"): frame = next(frames_rgb, None)
+            if frame is None: break
+            if i >= start:
+                with profile("convert"): frame = cv2.cvtColor(np.asarray(frame), code)
+                yield frame
+            i = i + 1
+
+        del[frames_rgb]
+
+def open_video(filepath, decoder="pyav", threads=0):
+    if decoder == "pyav": return PyAVReader(filepath, threads)
+    elif decoder == "opencv": return OpenCVReader(filepath, threads)
+    elif decoder == "pims": return PimsReader(filepath, threads)
+    raise ValueError("unknown decoder: " + str(decoder))
@@ -0,0 +1,75 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc background encoding stage: frames are encoded by a separate thread while the next ones are interpolated
+"""
+import queue
+import threading
+import time
+
+from profiling import profile
+
+# wraps a cv2.VideoWriter (or anything with write and release): write() puts the frame in a bounded queue
+# and returns immediately, a background thread encodes the queued frames (opencv releases the GIL while encoding);
+# when the encoder falls behind the queue gets full and write() blocks until there is room (backpressure),
+# so at most queue_size frames are waiting in memory.
+# the frames must not be modified after write(), since they are encoded later: on_written(frame), if given,
+# is called when a frame has been encoded and its buffer can be reused
+class BackgroundEncoder:
+    def __init__(self, output_video, queue_size=16, on_written=None):
+        self.output_video = output_video
+        self.on_written = on_written
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+        self.frames = 0
+        self.encode_time = 0.0                                                  # time spent by the thread encoding
+        self.wait_time = 0.0                                                    # time spent by write() waiting for the encoder
+        self.max_depth = 0
+
+        self.thread = threading.Thread(target=self.run, name="encoder", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None: break
+            if self.error is not None: continue                                # keeps consuming, so that write() never blocks forever
+
+            try:
+                start = time.perf_counter()
+                with profile("encode"): self.output_video.write(frame)
+                self.encode_time += time.perf_counter() - start
+                self.frames += 1
+            except Exception as e:
+                self.error = e
+
+            if self.on_written is not None: self.on_written(frame)
+
+    def write(self, frame):
+        if self.error is not None: raise self.error
+
+        start = time.perf_counter()
+        self.queue.put(frame)
+        self.wait_time += time.perf_counter() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    # waits for the queued frames to be encoded, then closes the video
+    def release(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.output_video.release()
+
+        if self.error is not None: raise self.error
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {"frames": self.frames,
+                "encoder_fps": self.frames/self.encode_time if self.encode_time else 0.0,
+                "encode_time": self.encode_time,
+                "wait_time": self.wait_time,
+                "queue_depth": self.depth(),
+                "max_queue_depth": self.max_depth,
+                "queue_size": self.queue.maxsize}
@@ -0,0 +1,278 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc optical flow estimation (Gunnar-Farneback and Lucas-Kanade) used by the mci modes
+"""
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+import cv2
+
+from buffers import workspace
+from profiling import profile
+
+# quality/speed presets: the flow is estimated on frames downscaled by "scale" (the motion is smaller too, so it needs
+# less pyramid levels); on high resolution content 1/2 and 1/4 cut the flow time by ~4x and ~16x with a small SSIM loss
+FLOW_PRESETS = {"quality":  {"scale": 1.0,  "levels": 3, "winsize": 15},
+                "balanced": {"scale": 0.5,  "levels": 3, "winsize": 15},
+                "fast":     {"scale": 0.25, "levels": 2, "winsize": 11}}
+
+# a frame with what its flows need, computed once: its gray version at the resolution of the flow (see OpticalFlow.prepare).
+# the pyramids of Lucas-Kanade are still built by every calcOpticalFlowPyrLK: its Python binding doesn't take
+# the ones of cv2.buildOpticalFlowPyramid
+class PreparedFrame:
+    def __init__(self, frame, gray):
+        self.frame = frame
+        self.gray = gray
+
+# the frame itself, for a frame or a PreparedFrame
+def frame_of(frame):
+    return frame.frame if isinstance(frame, PreparedFrame) else frame
+
+# optical flow estimator: calling it on two BGR frames returns the dense flow (h x w x 2, float32) from the first to the second
+# (written into dst, if given). The gray and downscaled frames are work buffers reused from one call to the next.
+# a source frame is in the flows of two pairs (and in several flows of the same pair): prepare() computes its gray frame
+# once and keeps the last prepared_frames of them, so the adjacent pairs, also on other threads, share them.
+# mode is "GF" (Gunnar-Farneback) or "LK" (Lucas-Kanade); lk_grid is the spacing in pixel of the points
+# tracked by Lucas-Kanade (1 tracks every pixel); cache is an optional flowcache.FlowCache;
+# scale is the resolution (relative to the frames) at which the flow is estimated, levels and winsize
+# are the pyramid levels and the window size of Gunnar-Farneback (see FLOW_PRESETS);
+# warm_start=True starts every Gunnar-Farneback flow from the one of the previous pair (see farneback), refined with
+# warm_levels pyramid levels and warm_iterations iterations; it needs the pairs in order (a single worker)
+class OpticalFlow:
+    def __init__(self, mode="GF", lk_grid=8, cache=None, scale=1.0, levels=3, winsize=15, warm_start=False, warm_levels=1, warm_iterations=2,
+                 warm_tolerance=1.25, prepared_frames=4):
+        if mode not in ("GF", "LK"): raise ValueError("unknown optical flow mode: " + str(mode))
+        if lk_grid < 1: raise ValueError("lk_grid must be at least 1")
+        if not 0 < scale <= 1: raise ValueError("scale must be in (0,1]")
+
+        self.mode = mode
+        self.lk_grid = lk_grid
+        self.cache = cache
+        self.scale = scale
+        self.levels = levels
+        self.winsize = winsize
+        self.lk_points_cache = { }                                              # (h, w) -> tracked points and shape of their grid
+        self.prepared_frames = prepared_frames
+        self.prepared = OrderedDict()                                           # id of a frame -> its PreparedFrame, least recently used first
+        self.prepared_lock = threading.Lock()
+        self.warm_start = warm_start
+        self.warm_levels = warm_levels
+        self.warm_iterations = warm_iterations
+        self.warm_tolerance = warm_tolerance
+        self.last_flows = deque(maxlen=2)                                       # (prev, next, flow) of the last flows between prepared frames
+        self.reference_error = 0.0                                              # residual error of the last flow computed from scratch
+
+    # the prepared frames are not sent to the processes of a process pool (and the lock can't be)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["prepared"], state["prepared_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prepared = OrderedDict()
+        self.prepared_lock = threading.Lock()
+
+    # every setting that changes the resulting flow (used as part of the key of the flow cache)
+    def settings(self):
+        settings = "mode=" + self.mode + ";lk_grid=" + str(self.lk_grid) + ";scale=" + str(self.scale) + ";levels=" + str(self.levels) + ";winsize=" + str(self.winsize)
+        if self.warm_start and self.mode == "GF":
+            settings += ";warm_levels=" + str(self.warm_levels) + ";warm_iterations=" + str(self.warm_iterations) + ";warm_tolerance=" + str(self.warm_tolerance)
+
+        return settings
+
+    # anchor_frame and target_frame are frames or PreparedFrames; only the flows between two source frames (PreparedFrames)
+    # are cached: the ones of the frames made by the interpolation depend on the render, and would never be found again
+    def __call__(self, anchor_frame, target_frame, dst=None):
+        if self.cache is None or not (isinstance(anchor_frame, PreparedFrame) and isinstance(target_frame, PreparedFrame)):
+            with profile("flow"): return self.estimate(anchor_frame, target_frame, dst)
+
+        with profile("flow_cache"):
+            key = self.cache.key(frame_of(anchor_frame), frame_of(target_frame), self.settings())
+            flow = self.cache.get(key)
+        if flow is None:
+            with profile("flow"): flow = self.estimate(anchor_frame, target_frame, dst)
+            with profile("flow_cache"): self.cache.put(key, flow)
+        elif dst is not None:
+            np.copyto(dst, flow)
+            flow = dst
+
+        return flow
+
+    # the PreparedFrame of a frame that will be in other flows (a source frame): computed only if it is not one
+    # of the last prepared ones. The frame must not change while it is prepared (the frames of a buffers.FramePool
+    # are reused, so they are not prepared)
+    def prepare(self, frame):
+        if isinstance(frame, PreparedFrame): return frame
+
+        key = id(frame)
+        with self.prepared_lock:
+            prepared = self.prepared.get(key)
+            if prepared is not None and prepared.frame is frame:
+                self.prepared.move_to_end(key)
+                return prepared
+
+        with profile("prepare"): prepared = PreparedFrame(frame, self.precompute(frame))
+        with self.prepared_lock:
+            self.prepared[key] = prepared                                       # keeps a reference to the frame, so its id is not reused
+            self.prepared.move_to_end(key)
+            while len(self.prepared) > self.prepared_frames: self.prepared.popitem(last=False)
+
+        return prepared
+
+    # gray frame at the resolution of the flow of a frame;
+    # buffer names the work buffers to write them into ("prev" or "next"), None allocates them
+    def precompute(self, frame, buffer=None):
+        h, w = frame.shape[:2]
+        image = gray(frame, workspace.get("gray_" + buffer, (h, w), np.uint8) if buffer else None)
+
+        # multi-resolution: the flow is estimated on the downscaled pair, then its vectors are upsampled and rescaled
+        if self.scale != 1:
+            small_size = self.small_size(h, w)
+            image = cv2.resize(image, small_size, dst=workspace.get("small_" + buffer, small_size[::-1], np.uint8) if buffer else None,
+                               interpolation=cv2.INTER_AREA)
+
+        return image
+
+    def small_size(self, h, w):
+        return (max(1, round(w*self.scale)), max(1, round(h*self.scale)))
+
+    def estimate(self, anchor_frame, target_frame, dst=None):
+        sources = isinstance(anchor_frame, PreparedFrame) and isinstance(target_frame, PreparedFrame)  # source frames (see prepare), can be warm started
+        prev = anchor_frame if isinstance(anchor_frame, PreparedFrame) else PreparedFrame(anchor_frame, self.precompute(anchor_frame, "prev"))
+        next = target_frame if isinstance(target_frame, PreparedFrame) else PreparedFrame(target_frame, self.precompute(target_frame, "next"))
+
+        if self.scale == 1:
+            if self.mode == "GF": return self.farneback(prev, next, dst, sources)
+            else: return self.lucas_kanade(prev, next, dst)
+
+        h, w = prev.frame.shape[:2]
+        small_size = self.small_size(h, w)
+        small_flow = workspace.get("small_flow", small_size[::-1] + (2,))
+
+        if self.mode == "GF": small_flow = self.farneback(prev, next, small_flow, sources)
+        else: small_flow = self.lucas_kanade(prev, next, small_flow)
+
+        flow = cv2.resize(small_flow, (w, h), dst=dst, interpolation=cv2.INTER_LINEAR)
+        flow[:,:,0] *= w / small_size[0]
+        flow[:,:,1] *= h / small_size[1]
+
+        return flow
+
+    # dense optical flow (Gunnar-Farneback method).
+    # with warm_start, the flow between two source frames starts from the last one that continues it (the flow of
+    # the previous pair in the same direction: it ends on prev, or starts from next for the backward flows),
+    # with OPTFLOW_USE_INITIAL_FLOW and less pyramid levels and iterations; the motion of consecutive pairs is similar,
+    # so only a small correction is left. The flow is computed again from scratch when its residual error (see residual)
+    # is above warm_tolerance times the one of the last flow computed from scratch (plus one gray level), and there is
+    # no previous flow after a scene cut or a pair that is not motion compensated
+    def farneback(self, prev, next, dst=None, sources=False):
+        if not (self.warm_start and sources): return cv2.calcOpticalFlowFarneback(prev.gray, next.gray, dst, 0.5, self.levels, self.winsize, 3, 5, 1.2, 0)
+
+        flow = None
+        seed = self.seed(prev, next)
+        if seed is not None:
+            if dst is None: dst = seed.copy()
+            else: np.copyto(dst, seed)
+            flow = cv2.calcOpticalFlowFarneback(prev.gray, next.gray, dst, 0.5, self.warm_levels, self.winsize, self.warm_iterations, 5, 1.2,
+                                                cv2.OPTFLOW_USE_INITIAL_FLOW)
+            with profile("flow_check"): error = self.residual(prev, next, flow)
+            if error > self.warm_tolerance * self.reference_error + 1: flow = None  # poor convergence
+        if flow is None:
+            with profile("flow_cold"): flow = cv2.calcOpticalFlowFarneback(prev.gray, next.gray, dst, 0.5, self.levels, self.winsize, 3, 5, 1.2, 0)
+            with profile("flow_check"): self.reference_error = self.residual(prev, next, flow)
+
+        self.last_flows.append((prev, next, flow.copy()))
+        return flow
+
+    # initial estimate of the flow from prev to next: the last flow that ends on prev (but doesn't start from next,
+    # that is the opposite flow of this pair) or that starts from next (but doesn't end on prev), if any
+    def seed(self, prev, next):
+        for start, end, flow in reversed(self.last_flows):
+            if flow.shape[:2] != prev.gray.shape[:2]: continue
+            if (end is prev and start is not next) or (start is next and end is not prev): return flow
+
+        return None
+
+    # mean absolute difference (gray levels) between prev and next moved back along the flow
+    def residual(self, prev, next, flow):
+        h, w = flow.shape[:2]
+        flow_map = cv2.add(base_map(h, w), flow, dst=workspace.get("warm_map", (h, w, 2)))
+        warped = cv2.remap(next.gray, flow_map, None, cv2.INTER_LINEAR, dst=workspace.get("warm_warped", (h, w), np.uint8), borderMode=cv2.BORDER_REPLICATE)
+
+        return cv2.norm(warped, prev.gray, cv2.NORM_L1) / (h * w)
+
+    # sparse optical flow (Lucas-Kanade method) on a grid of points, one every lk_grid pixels:
+    # the motion vectors are then upsampled to a dense flow with a bilinear resize
+    def lucas_kanade(self, prev, next, dst=None):
+        h, w = prev.gray.shape[:2]
+        p0, grid_shape = self.lk_points(h, w)
+
+        p1, status, err = cv2.calcOpticalFlowPyrLK(prev.gray, next.gray, p0, None, winSize=(21,21), maxLevel=3)
+
+        vectors = (p1 - p0).reshape(grid_shape + (2,))
+        vectors[status.reshape(grid_shape) == 0] = 0                            # points that got lost don't move
+
+        if grid_shape == (h, w):
+            if dst is None: return vectors
+            np.copyto(dst, vectors)
+            return dst
+        return cv2.resize(vectors, (w, h), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+    # grid of tracked points, cached per resolution: the points are the centers of the cells of the grid,
+    # so they are aligned with the pixels of the bilinear upsampling
+    def lk_points(self, h, w):
+        if (h, w) not in self.lk_points_cache:
+            grid_h, grid_w = -(-h // self.lk_grid), -(-w // self.lk_grid)
+            ys = (np.arange(grid_h) + 0.5) * h / grid_h - 0.5
+            xs = (np.arange(grid_w) + 0.5) * w / grid_w - 0.5
+            grid_x, grid_y = np.meshgrid(xs, ys)
+            p0 = np.stack((grid_x.flatten(),grid_y.flatten()),axis=1).astype(np.float32)
+
+            self.lk_points_cache[(h, w)] = (p0, (grid_h, grid_w))
+
+        return self.lk_points_cache[(h, w)]
+
+# have to convert in gray in order to have same channel to calculate motion vectors
+def gray(frame, dst=None):
+    if frame.ndim == 2: return frame
+    return cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY, dst=dst)
+
+# coordinates of every pixel (x, y), cached per resolution (read only)
+base_maps = { }
+
+def base_map(h, w):
+    if (h, w) not in base_maps:
+        grid = np.empty((h, w, 2), dtype=np.float32)
+        grid[:,:,0] = np.arange(w)
+        grid[:,:,1] = np.arange(h)[:,np.newaxis]
+        base_maps[(h, w)] = grid
+
+    return base_maps[(h, w)]
+
+# converts a flow in the coordinates map used by cv2.remap: every pixel is moved back along t times its motion vector
+# (base coordinates - t*flow, written into dst if given)
+def flow_to_map(flow, t=1.0, dst=None):
+    h, w = flow.shape[:2]
+    return cv2.scaleAdd(flow, -t, base_map(h, w), dst=dst)
+
+def draw_hsv(anchor_frame, flow):
+    hsv = np.zeros_like(anchor_frame)
+    hsv[...,1] = 255
+
+    mag, ang = cv2.cartToPolar(flow[...,0], flow[...,1])
+
+    hsv[...,0] = ang*180/np.pi/2
+    hsv[...,2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)
+    bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+    return bgr
+
+def ov_visualization(anchor_frame, flow, frame_num):
+    fname = 'img\\' + "HSV" + '\ov_' + str(frame_num) + '.jpg'
+    vis = draw_hsv(anchor_frame,flow)
+
+    print(fname)
+    cv2.imwrite(fname, vis)
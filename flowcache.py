@@ -0,0 +1,115 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc on-disk cache of optical flows, so that re-rendering the same clip (other framerate, other mode) skips the flow estimation
+"""
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+# every flow is stored as a compressed float16 .npz file, named after a hash of the two frames and of the settings of the estimator;
+# when the files exceed max_size_mb the least recently used ones are deleted (the last use is the modification time of the file,
+# so the order is kept between different runs).
+# copies of the cache in other processes (a process pool, the jobs of a chunked render) share the directory, but not
+# the statistics: hits and misses are counted by every process for its own lookups, while the files are rescanned
+# by stats() and, at most every RESCAN_SECONDS, by the copies before evicting, so max_size_mb holds for all of them
+RESCAN_SECONDS = 1.0
+
+class FlowCache:
+    def __init__(self, directory, max_size_mb=1024):
+        self.directory = directory
+        self.max_size = max_size_mb * 1000000
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.copy = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    # the lock can't be pickled: every process of a pool gets its own one (and its own statistics)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.copy = True
+
+    # sizes of the files in the directory, written by any process
+    def scan(self):
+        sizes = { }
+        for f in os.listdir(self.directory):
+            if not f.endswith(".npz"): continue
+            try: sizes[f] = os.path.getsize(os.path.join(self.directory, f))
+            except OSError: pass                                                # evicted in the meantime
+
+        self.sizes = sizes
+        self.scanned = time.monotonic()
+
+    def key(self, anchor_frame, target_frame, settings):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(str(anchor_frame.shape).encode())
+        h.update(settings.encode())
+        h.update(np.ascontiguousarray(anchor_frame).data)
+        h.update(np.ascontiguousarray(target_frame).data)
+
+        return h.hexdigest() + ".npz"
+
+    # returns the cached flow (float32), or None
+    def get(self, key):
+        path = os.path.join(self.directory, key)
+
+        try:
+            with np.load(path) as data: flow = data["flow"].astype(np.float32)
+            os.utime(path)                                                      # marks the file as recently used
+        except (OSError, ValueError, KeyError):
+            with self.lock: self.misses += 1
+            return None
+
+        with self.lock: self.hits += 1
+        return flow
+
+    def put(self, key, flow):
+        path = os.path.join(self.directory, key)
+        tmp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+        with open(tmp_path, "wb") as f: np.savez_compressed(f, flow=flow.astype(np.float16))
+        os.replace(tmp_path, path)                                              # atomic, other readers never see half-written files
+
+        with self.lock:
+            self.sizes[key] = os.path.getsize(path)
+            self.evict()
+
+    # deletes the least recently used files until the cache fits in max_size
+    def evict(self):
+        if self.copy and time.monotonic() - self.scanned > RESCAN_SECONDS: self.scan()
+        if sum(self.sizes.values()) <= self.max_size: return
+
+        def last_use(key):
+            try: return os.path.getmtime(os.path.join(self.directory, key))
+            except OSError: return 0
+
+        for key in sorted(self.sizes, key=last_use):
+            if sum(self.sizes.values()) <= self.max_size: break
+            try: os.remove(os.path.join(self.directory, key))
+            except OSError: pass                                                # already evicted by another process
+            del self.sizes[key]
+            self.evictions += 1
+
+    # hits, misses and evictions of this process; files and size of the whole directory
+    def stats(self):
+        with self.lock: self.scan()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "files": len(self.sizes),
+                "size_mb": sum(self.sizes.values()) / 1000000}
@@ -0,0 +1,108 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc on-disk store of decoded frames: a video is decoded once into a raw memory-mapped file,
+ #       so re-running dup/blend/mci on the same input skips the decoding
+"""
+import hashlib
+import os
+import struct
+from fractions import Fraction
+
+import numpy as np
+
+# a .frames file is a header (magic, height, width, channels, number of frames, framerate as numerator/denominator)
+# padded to HEADER_SIZE bytes, followed by the frames (uint8, height x width x channels, one after the other)
+MAGIC = b"VFIFRM01"
+HEADER = struct.Struct("<8sIIIIII")
+HEADER_SIZE = 64
+
+# a decoded video in a .frames file: same interface of the readers of decoder.py, but every frame is a read-only view
+# of the memory-mapped file (no copy, no decoding): the pages are read from disk when they are used, and the OS
+# page cache, instead of the Python heap, decides how many of them stay in memory
+class StoredVideo:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, h, w, channels, l_frames, fps_num, fps_den = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC: raise ValueError("not a frame store: " + path)
+
+        self.size = (w, h)
+        self.fps = Fraction(fps_num, fps_den)
+        self.l_frames = l_frames
+        self.data = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(l_frames, h, w, channels))
+
+    def info(self):
+        return self.size, self.fps, self.l_frames
+
+    def frames(self, start=0, stop=None, gray=False):
+        for i in range(start, self.l_frames if stop is None else min(stop, self.l_frames)):
+            frame = np.asarray(self.data[i])                                    # plain ndarray view, no copy
+            if gray:
+                import cv2
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield frame
+
+# directory of .frames files, one per input video (named after its path, size and modification time,
+# so a modified file is decoded again)
+class FrameStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, filepath):
+        st = os.stat(filepath)
+        key = os.path.abspath(filepath) + ";" + str(st.st_size) + ";" + str(st.st_mtime_ns)
+        return os.path.join(self.directory, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + ".frames")
+
+    # the stored video of filepath, or None if it has not been stored (completely) yet
+    def open(self, filepath):
+        path = self.path(filepath)
+        if not os.path.exists(path): return None
+
+        try: return StoredVideo(path)
+        except (OSError, ValueError): return None
+
+    # passes the decoded frames of filepath through, writing them in the store: the file appears when
+    # all the l_frames frames (or all the frames up to the end of the video) are written, else it is discarded
+    def record(self, filepath, frames, fps, l_frames):
+        path = self.path(filepath)
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        written = 0
+        shape = None
+        f = open(tmp_path, "wb")
+
+        try:
+            f.write(bytes(HEADER_SIZE))
+            for frame in frames:
+                if not f.closed:                                                # the frames after the l_frames ones are not stored
+                    if shape is None: shape = frame.shape
+                    f.write(np.ascontiguousarray(frame).data)
+                    written = written + 1
+                    if written == l_frames: self.close(f, tmp_path, path, shape, fps, written)
+                yield frame
+            if not f.closed and written > 0: self.close(f, tmp_path, path, shape, fps, written)
+        finally:
+            if not f.closed:
+                f.close()
+                os.remove(tmp_path)
+
+    def close(self, f, tmp_path, path, shape, fps, l_frames):
+        h, w = shape[:2]
+        channels = shape[2] if len(shape) == 3 else 1
+        fps = Fraction(fps)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, h, w, channels, l_frames, fps.numerator, fps.denominator))
+        f.close()
+        os.replace(tmp_path, path)
+
+    def remove(self, filepath):
+        try: os.remove(self.path(filepath))
+        except OSError: pass
+
+    # removes all the stored videos (but the ones still mapped, on Windows)
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".frames"): continue
+            try: os.remove(os.path.join(self.directory, name))
+            except OSError: pass
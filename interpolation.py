@@ -0,0 +1,404 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc video interpolation core: frame reading/writing and interpolation modes,
+ #       without any GUI dependency (used by interpolator.py and cli.py)
+"""
+import math
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from fractions import Fraction
+
+import numpy as np
+import cv2                                                                      # for mci functions
+
+from adaptive import ModeSelector
+from buffers import FramePool, new_frame, workspace
+from decoder import open_video
+from encoder import BackgroundEncoder
+from flow import OpticalFlow, flow_to_map, ov_visualization
+from framestore import FrameStore
+from profiling import profile
+
+MODES = ("dup", "blend", "farneback", "lk", "auto")
+QUEUE_SIZE = 16                                                                 # frames waiting for the encoder
+
+# default progress callback: does nothing
+def no_progress(value):
+    pass
+
+# raised by render when the job is cancelled
+class Cancelled(Exception):
+    pass
+
+# ---- CALCULATION FUNCTIONS ----
+
+# normalization in [0,100] for progressbar
+def normalize(value, min, max):
+    if max <= min: return 100
+    return int(((value-min)/(max-min))*100)
+
+# exact framerate conversion: the output frame n is at the time n/fps_out, that is at the position n*fps_in/fps_out
+# of the source frames (computed with rationals, so 24000/1001 -> 60 keeps the duration of the input).
+# yields, for every source frame i from start to stop (excluded), (i, the positions t in [0,1) of the output frames between
+# the frames i and i+1) (t = 0 is the source frame itself); the output ends with the input, so the last frame is never interpolated
+def frame_times(fps_in, fps_out, l_frames_in, start=0, stop=None):
+    ratio = Fraction(fps_in) / Fraction(fps_out)
+    l_frames_out = math.ceil(l_frames_in / ratio)
+    n = math.ceil(start / ratio)                                                # first output frame at or after the source frame start
+
+    for i in range(start, l_frames_in if stop is None else min(stop, l_frames_in)):
+        times = [ ]
+        while n < l_frames_out and n*ratio < i+1:
+            times.append(n*ratio - i)
+            n = n + 1
+        yield i, times
+
+# output framerate as an exact rational: "60", "60000/1001", "12.5"... the decimal NTSC shorthands
+# (59.94, 29.97, 23.976...) are the rates x*1000/1001, e.g. 59.94 -> 60000/1001
+def parse_fps(value):
+    fps = Fraction(value).limit_denominator(1001)
+    if "/" not in str(value) and fps.denominator != 1:
+        ntsc = Fraction(round(fps * Fraction(1001, 1000)) * 1000, 1001)
+        if abs(fps - ntsc) < Fraction(1, 200): fps = ntsc
+    if fps <= 0: raise ValueError("the framerate must be positive: " + str(value))
+
+    return fps
+
+# tiles of a h x w frame, tile_size x tile_size pixels: for every tile the region of the frame it covers (core)
+# and the same region with margin pixels of context on every side (expanded), both as (y0, y1, x0, x1)
+def tile_grid(h, w, tile_size, margin):
+    tiles = [ ]
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            core = (y, min(y+tile_size, h), x, min(x+tile_size, w))
+            expanded = (max(0, y-margin), min(h, core[1]+margin), max(0, x-margin), min(w, core[3]+margin))
+            tiles.append((core, expanded))
+
+    return tiles
+
+# streaming core of every upsampling mode: only a sliding window of two source frames
+# (anchor and target) is kept in memory, and the "missing frames" between them, at the positions times
+# (see frame_times), are generated by fill_pair(anchor, target, times, index) and yielded as soon as they are ready;
+# the anchor is yielded only if an output frame falls exactly on it, and after the last source frame it is repeated.
+# frames_in starts with the first source frame of times and goes one frame beyond its last one (the target of its last pair)
+def interpolate_stream(frames_in, l_frames_in, times, fill_pair, progress=no_progress):
+    frames_in = iter(frames_in)
+    anchor = next(frames_in, None)
+
+    for i, pair_times in times:
+        if anchor is None: break
+
+        progress(normalize(i,0,l_frames_in-1))
+        target = next(frames_in, None)
+        if pair_times and pair_times[0] == 0: yield anchor
+
+        missing = [float(t) for t in pair_times if t > 0]
+        if missing:
+            if target is not None: yield from fill_pair(anchor, target, missing, i)
+            else: yield from dup_pair(anchor, None, missing, i)
+
+        anchor = target
+
+# ---- VIDEO FUNCTIONS ----
+
+# the modes take the positions of the output frames of every pair of source frames (times, see frame_times)
+
+# dup mode: the frame i is equal to frame i-1 (his predecessor)
+def dup(frames_in, l_frames_in, times, progress=no_progress):
+    return interpolate_stream(frames_in, l_frames_in, times, dup_pair, progress)
+
+def dup_pair(anchor, target, times, index):
+    return [anchor] * len(times)
+
+# blend mode: the frame i is given by the average between frame i-1 (its predecessor) and frame i+1 (its successor),
+# weighted by its temporal position t between them; pool is an optional buffers.FramePool for the missing frames
+def blend(frames_in, l_frames_in, times, progress=no_progress, pool=None):
+    return interpolate_stream(frames_in, l_frames_in, times, lambda anchor, target, times, index: blend_pair(anchor, target, times, index, pool), progress)
+
+# all the missing frames of a pair are computed at once, (1-t)*anchor + t*target, directly in uint8
+# (opencv saturates and rounds the weighted sum) into preallocated frames
+def blend_pair(anchor, target, times, index, pool=None):
+    missing_frames = [new_frame(pool, anchor.shape) for t in times]
+
+    with profile("blend"):
+        for frame, t in zip(missing_frames, times):
+            cv2.addWeighted(anchor, 1-t, target, t, 0, dst=frame)
+
+    return missing_frames
+
+# mci mode: the frame i is given by the motion compensation between frame i-1 (its predecessor) and frame i+1 (its successor)
+# with workers > 1 the source pairs are compensated in parallel (see mci_parallel),
+# with bidirectional=True the flows are computed once per pair (see mci_pair_bidirectional);
+# mode is the optical flow method ("GF" or "LK") and flow_options are the settings of its estimator (see flow.OpticalFlow);
+# pool is an optional buffers.FramePool for the missing frames (not used with a process pool);
+# scene_cut is an optional scenecut.SceneCutDetector: the pairs across a cut are filled by its fallback, without any flow;
+# selector is an optional adaptive.ModeSelector (auto mode): only the pairs it assigns to "mci" are motion compensated;
+# tile_size > 0 enables the tiled mci (see mci_tiled), with tile_margin pixels of context around every tile
+def mci(frames_in, l_frames_in, times, mode, progress=no_progress, workers=1, processes=False, bidirectional=False, flow_options=None, pool=None, scene_cut=None, selector=None,
+        tile_size=0, tile_margin=64):
+    estimator = OpticalFlow(mode, prepared_frames=2*workers + 2, **(flow_options or { }))     # the source frames of the pairs in flight
+    if workers > 1 or tile_size: estimator.warm_start = False                  # the flows of the previous pair may not be done yet
+
+    if tile_size: return mci_tiled(frames_in, l_frames_in, times, estimator, workers, progress, bidirectional, pool, scene_cut, selector, tile_size, tile_margin)
+    if workers > 1: return mci_parallel(frames_in, l_frames_in, times, estimator, workers, processes, progress, bidirectional, pool, scene_cut, selector)
+
+    def fill_pair(anchor, target, times, index):
+        pair = pair_mode(anchor, target, index, scene_cut, selector)
+        if pair != "mci": return simple_pair(anchor, target, times, index, pair, pool)
+        return mci_pair(anchor, target, times, estimator, index, bidirectional, pool)
+
+    return interpolate_stream(frames_in, l_frames_in, times, fill_pair, progress)
+
+# mode of the missing frames of the pair starting at the source frame index:
+# the fallback of scene_cut across a cut, else the choice of selector, else "mci"
+def pair_mode(anchor, target, index, scene_cut=None, selector=None):
+    if scene_cut is not None and scene_cut(anchor, target, index): return scene_cut.fallback
+    if selector is not None: return selector(anchor, target, index)
+    return "mci"
+
+# missing frames of a pair that is not motion compensated: mode is "dup" or "blend"
+def simple_pair(anchor, target, times, index, mode, pool=None):
+    if mode == "blend": return blend_pair(anchor, target, times, index, pool)
+    return dup_pair(anchor, target, times, index)
+
+# all the missing frames between a pair of source frames: every pair is independent from the others,
+# so this is the unit of work of mci_parallel (module-level function, so it can be sent to a process pool);
+# the flow from anchor to target is computed once per pair, and the missing frame at time t is the anchor moved along
+# t times that flow, so every frame is made once at its true position and the flow cost doesn't depend on the multiplier.
+# the gray frames of anchor and target are computed once (see flow.OpticalFlow.prepare); flow and coordinates map
+# are work buffers of the thread
+def mci_pair(anchor, target, times, estimator, index, bidirectional=False, pool=None):
+    if bidirectional: return mci_pair_bidirectional(anchor, target, times, estimator, index, pool)
+
+    h, w = anchor.shape[:2]
+    flow = estimator(estimator.prepare(anchor), estimator.prepare(target), workspace.get("flow", (h, w, 2)))
+    flow_map = workspace.get("map", (h, w, 2))
+
+    #ov_visualization(anchor, flow, index)
+
+    missing_frames = [new_frame(pool, anchor.shape) for t in times]
+    for frame, t in zip(missing_frames, times):
+        with profile("remap"): cv2.remap(anchor, flow_to_map(flow, t, flow_map), None, cv2.INTER_LINEAR, dst=frame)
+
+    return missing_frames
+
+# bidirectional mci: forward (anchor -> target) and backward (target -> anchor) flows are computed only once per pair;
+# the missing frame at time t is the blend, weighted by t, of the anchor moved along t times the forward flow
+# and of the target moved along (1-t) times the backward flow, so the occlusions of one side are filled by the other
+def mci_pair_bidirectional(anchor, target, times, estimator, index, pool=None):
+    h, w = anchor.shape[:2]
+    prepared_anchor, prepared_target = estimator.prepare(anchor), estimator.prepare(target)
+    flow_forward = estimator(prepared_anchor, prepared_target, workspace.get("flow_forward", (h, w, 2)))
+    flow_backward = estimator(prepared_target, prepared_anchor, workspace.get("flow_backward", (h, w, 2)))
+    map_anchor = workspace.get("map_anchor", (h, w, 2))
+    map_target = workspace.get("map_target", (h, w, 2))
+    from_anchor = workspace.get("from_anchor", anchor.shape, np.uint8)
+    from_target = workspace.get("from_target", anchor.shape, np.uint8)
+
+    missing_frames = [new_frame(pool, anchor.shape) for t in times]
+
+    for frame, t in zip(missing_frames, times):
+        with profile("remap"):
+            cv2.remap(anchor, flow_to_map(flow_forward, t, map_anchor), None, cv2.INTER_LINEAR, dst=from_anchor)
+            cv2.remap(target, flow_to_map(flow_backward, 1-t, map_target), None, cv2.INTER_LINEAR, dst=from_target)
+        with profile("blend"): cv2.addWeighted(from_anchor, 1-t, from_target, t, 0, dst=frame)
+
+    return missing_frames
+
+# parallel mci: the source pairs are dispatched to a pool of workers (threads by default, since opencv
+# releases the GIL, or processes) and the results are written in order through a bounded reorder buffer:
+# at most 2*workers pairs are in flight, so the memory stays flat and the reader waits for the slowest pair
+def mci_parallel(frames_in, l_frames_in, times, estimator, workers, processes=False, progress=no_progress, bidirectional=False, frame_pool=None, scene_cut=None, selector=None,
+                 fill_mci=mci_pair):
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    if processes: frame_pool = None                                             # the frames of the other processes come back as copies
+    max_pending = 2 * workers
+    pending = deque()                                                           # (index, anchor if it is written, future or None) in input order
+
+    frames_in = iter(frames_in)
+    times = iter(times)
+    anchor = next(frames_in, None)
+
+    with pool_class(max_workers=workers) as pool:
+        while anchor is not None or pending:
+            if anchor is not None and len(pending) < max_pending:
+                i, pair_times = next(times, (None, None))
+                if pair_times is None:                                          # the output is over
+                    anchor = None
+                    continue
+
+                target = next(frames_in, None)
+                first = anchor if pair_times and pair_times[0] == 0 else None
+                missing = [float(t) for t in pair_times if t > 0]
+                future = None
+                if missing and target is None: future = pool.submit(dup_pair, anchor, None, missing, i)
+                elif missing:
+                    pair = pair_mode(anchor, target, i, scene_cut, selector)
+                    if pair != "mci": future = pool.submit(simple_pair, anchor, target, missing, i, pair, frame_pool)
+                    else: future = pool.submit(fill_mci, anchor, target, missing, estimator, i, bidirectional, frame_pool)
+                pending.append((i, first, future))
+                anchor = target
+                continue
+
+            # the buffer is full (or the input is over): the oldest pair is the next one to be written
+            index, first, future = pending.popleft()
+            progress(normalize(index,0,l_frames_in-1))
+            if first is not None: yield first
+            if future is not None: yield from future.result()
+
+# tiled mci, for very high resolution frames (4K, 8K): every pair is split in tiles (see tile_grid), whose flows and
+# remaps are computed independently by a pool of "workers" threads, so the work buffers of every worker (gray frames,
+# flows, coordinate maps) are as large as a tile and a single pair is compensated in parallel; with workers > 1
+# the pairs are also dispatched in parallel (see mci_parallel, always with threads).
+# every tile is compensated with its margin of context, which is then cropped: the motion that crosses a tile border
+# is still found (up to tile_margin pixels), so the seams between the tiles don't show
+def mci_tiled(frames_in, l_frames_in, times, estimator, workers, progress=no_progress, bidirectional=False, pool=None, scene_cut=None, selector=None,
+              tile_size=512, tile_margin=64):
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as tile_pool:
+        def fill_mci(anchor, target, times, estimator, index, bidirectional, pool):
+            return mci_pair_tiled(anchor, target, times, estimator, index, bidirectional, pool, tile_pool, tile_size, tile_margin, 2*workers)
+
+        if workers > 1:
+            yield from mci_parallel(frames_in, l_frames_in, times, estimator, workers, False, progress, bidirectional, pool, scene_cut, selector, fill_mci)
+            return
+
+        def fill_pair(anchor, target, times, index):
+            pair = pair_mode(anchor, target, index, scene_cut, selector)
+            if pair != "mci": return simple_pair(anchor, target, times, index, pair, pool)
+            return fill_mci(anchor, target, times, estimator, index, bidirectional, pool)
+
+        yield from interpolate_stream(frames_in, l_frames_in, times, fill_pair, progress)
+
+# all the missing frames of a pair, compensated tile by tile on tile_pool and put together without the margins:
+# every tile is copied into the missing frames as soon as it is done, and then dropped, and at most max_tiles tiles
+# are in flight, so the tiles alive at the same time don't grow with the resolution
+def mci_pair_tiled(anchor, target, times, estimator, index, bidirectional, pool, tile_pool, tile_size, tile_margin, max_tiles):
+    h, w = anchor.shape[:2]
+    missing_frames = [new_frame(pool, anchor.shape) for t in times]
+    running = { }                                                               # future -> core and origin of its tile
+
+    def collect(done):
+        for job in done:
+            (cy0, cy1, cx0, cx1), y0, x0 = running.pop(job)
+            for frame, tile in zip(missing_frames, job.result()):
+                frame[cy0:cy1, cx0:cx1] = tile[cy0-y0:cy1-y0, cx0-x0:cx1-x0]
+
+    for core, (y0, y1, x0, x1) in tile_grid(h, w, tile_size, tile_margin):
+        while len(running) >= max_tiles: collect(wait(running, return_when=FIRST_COMPLETED).done)
+        running[tile_pool.submit(mci_pair, anchor[y0:y1, x0:x1], target[y0:y1, x0:x1], times, estimator, index, bidirectional)] = (core, y0, x0)
+
+    while running: collect(wait(running, return_when=FIRST_COMPLETED).done)
+
+    return missing_frames
+
+# to reduce framerate: the output frame n is the source frame on screen at its time n/fps_out, that is
+# every source frame is written once for every output frame that falls between it and the next one (see frame_times)
+def gen_reduced_out(frames_in, l_frames_in, times, progress=no_progress):
+    for frame, (i, pair_times) in zip(frames_in, times):
+        if pair_times: progress(normalize(i,0,l_frames_in-1))
+        for t in pair_times: yield frame
+    progress(100)
+
+# the videos are read by a decoding backend of decoder.py: "pyav" (default), "opencv" or "pims"
+# (the original reader; opencv video reader suffered of memory leaks)
+
+# the decoded frames can also be kept in a framestore.FrameStore (store): a video found in the store is read from there,
+# without decoding it
+
+# returns the infos of the input video, without decoding its frames
+def read_video_info(filepath, decoder="pyav", store=None):
+    stored = store.open(filepath) if store is not None else None
+    size, fps_in, l_frames_in = (stored or open_video(filepath, decoder)).info()
+
+    return size, parse_fps(fps_in), l_frames_in                                 # exact rational framerate (e.g. 24000/1001), not truncated
+
+# generator of the input frames (BGR, or gray): frames are decoded one at a time, so the whole video is never held in memory;
+# start and stop (excluded) select a range of frames, reached by seeking; threads are the decoding threads (0: automatic).
+# with a store, a video not stored yet is written in it while it is decoded (only when the whole video is read in BGR)
+def read_video(filepath, start=0, stop=None, decoder="pyav", threads=0, gray=False, store=None):
+    stored = store.open(filepath) if store is not None else None
+    if stored is not None: return stored.frames(start, stop, gray)
+
+    reader = open_video(filepath, decoder, threads)
+    if store is None or start > 0 or stop is not None or gray: return reader.frames(start, stop, gray)
+
+    size, fps_in, l_frames_in = reader.info()
+    return store.record(filepath, reader.frames(), fps_in, l_frames_in)
+
+def generate_video(filepath, fps_output, size):
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')                                                # mp4v is the best encoder until now (mpg4 gave too much large output files)
+    output_video = cv2.VideoWriter(filepath, fourcc, float(fps_output), size, isColor = True)
+
+    return output_video
+
+# writes every frame as soon as the generator produces it: the encoding runs in a background thread,
+# overlapped with the interpolation of the next frames (at most queue_size frames wait to be encoded);
+# returns the statistics of the encoder; cancel is an optional threading.Event, checked before every frame.
+# the "frame" stage of the profiler is the latency of every output frame (it includes decode, flow, remap...);
+# the frames taken from pool (a buffers.FramePool) are given back to it once they are encoded
+def write_video(frames_out, filepath, fps_output, size, queue_size=QUEUE_SIZE, cancel=None, pool=None):
+    output_video = BackgroundEncoder(generate_video(filepath, fps_output, size), queue_size, pool.release if pool is not None else None)
+    frames_out = iter(frames_out)
+
+    try:
+        while True:
+            with profile("frame"): f = next(frames_out, None)
+            if f is None: break
+            if cancel is not None and cancel.is_set(): raise Cancelled()
+            with profile("write"): output_video.write(f)
+    finally:
+        output_video.release()
+
+    return output_video.stats()
+
+# ---- EXECUTION ----
+
+# interpolates (or reduces) the video in filepath_in to the framerate fps_out (any ratio with the input framerate,
+# the duration is kept: see frame_times), writing it in filepath_out;
+# mode is one of MODES and is ignored when fps_out is lower than the input framerate
+# workers > 1 enables the parallel mci (processes=True to use a process pool instead of threads),
+# bidirectional=True the mci with one forward and one backward flow per pair, flow_options are passed to flow.OpticalFlow,
+# scene_cut (a scenecut.SceneCutDetector) skips the flow across the cuts, which are recorded in scene_cut.cuts;
+# the auto mode chooses dup, blend or Gunnar-Farneback mci for every pair with selector (an adaptive.ModeSelector,
+# default thresholds if not given), which records the choices; tile_size > 0 compensates the frames in tiles (see mci_tiled);
+# returns the statistics of the encoder (see encoder.BackgroundEncoder).
+# setting the threading.Event cancel stops the job, removes the partial output and raises Cancelled.
+# start and stop (source frames, stop excluded) render only the output frames that fall between them, i.e. a segment
+# of the output video (see chunks.py): the source frame stop is decoded too, as target of the last pair.
+# decoder is the decoding backend (see read_video) and decode_threads its threads; frame_store (a framestore.FrameStore
+# or its directory) keeps the decoded frames on disk, so the next renders of the same input don't decode it again
+def render(filepath_in, filepath_out, fps_out, mode, progress=no_progress, workers=1, processes=False, bidirectional=False, flow_options=None, cancel=None, scene_cut=None,
+           selector=None, tile_size=0, tile_margin=64, start=0, stop=None, decoder="pyav", decode_threads=0, frame_store=None):
+    if mode not in MODES: raise ValueError("unknown interpolation mode: " + str(mode))
+    if isinstance(frame_store, str): frame_store = FrameStore(frame_store)
+
+    size, fps_in, l_frames_in = read_video_info(filepath_in, decoder, frame_store)
+    # frames are decoded, interpolated and written one at a time
+    frames_in = read_video(filepath_in, start, None if stop is None else stop+1, decoder, decode_threads, store=frame_store)
+
+    fps_out = parse_fps(fps_out)
+    times = frame_times(fps_in, fps_out, l_frames_in, start, stop)
+    pool = None
+
+    if fps_out > fps_in:
+        # missing frames alive at the same time: the ones queued in the encoder, plus the groups being interpolated
+        pool = FramePool(QUEUE_SIZE + 2 + math.ceil(fps_out/fps_in) * (2*workers + 1))
+
+        if mode == "dup": frames_out = dup(frames_in, l_frames_in, times, progress)
+        elif mode == "blend": frames_out = blend(frames_in, l_frames_in, times, progress, pool)
+        elif mode == "farneback": frames_out = mci(frames_in, l_frames_in, times, "GF", progress, workers, processes, bidirectional, flow_options, pool, scene_cut,
+                                                   None, tile_size, tile_margin)
+        elif mode == "lk": frames_out = mci(frames_in, l_frames_in, times, "LK", progress, workers, processes, bidirectional, flow_options, pool, scene_cut,
+                                            None, tile_size, tile_margin)
+        elif mode == "auto": frames_out = mci(frames_in, l_frames_in, times, "GF", progress, workers, processes, bidirectional, flow_options, pool, scene_cut,
+                                              selector if selector is not None else ModeSelector(), tile_size, tile_margin)
+    else:
+        frames_out = gen_reduced_out(frames_in, l_frames_in, times, progress)
+
+    try:
+        return write_video(frames_out, filepath_out, fps_out, size, cancel=cancel, pool=pool)
+    except Cancelled:
+        if os.path.exists(filepath_out): os.remove(filepath_out)
+        raise
@@ -6,14 +6,17 @@
  # @desc video interpolation project (subject: Multimedia)
 """
 import os
-import numpy as np
-import pims                                                                     # to read files
-import cv2                                                                      # for mci functions
+import tempfile
+import threading
+import time
 
 from PyQt5 import Qt, QtCore, QtGui, QtWidgets as qtw
 from PyQt5 import QtMultimedia as qtm
 from PyQt5.QtMultimediaWidgets import QVideoWidget
 
+from interpolation import Cancelled, read_video_info, render                      # GUI-independent core
+from framestore import FrameStore
+
 qtw.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)      # fix graphical issues on hidpi displays, enabling auto-scaling for higher resolutions
 
 # --- GUI CLASS ---
@@ -23,27 +26,35 @@ class MainWindow(qtw.QWidget):
         super().__init__()
         layout = qtw.QGridLayout()
         title = "Video interpolator"
+        self.frame_store = FrameStore(os.path.join(tempfile.gettempdir(), "video_frame_interpolator"))    # decoded frames of the input, removed on close
+        self.worker = None                                                                   # worker of the last render
 
         layout.addWidget(self.createInputOutputGroup(),0,0,1,3)
         layout.addWidget(self.createInputInfoGroup(),1,0)
         layout.addWidget(self.createInterpolationGroup(),1,1,1,2)
 
         self.pbar = qtw.QProgressBar()
+        self.status = qtw.QLabel()
+        self.cancelbtn = qtw.QPushButton("Cancel")
         self.btn = qtw.QPushButton("Run")
         self.helpbtn = qtw.QPushButton("Help")
         self.cmprbtn = qtw.QPushButton("Compare")
 
         self.btn.setDisabled(True)
         self.cmprbtn.setDisabled(True)
+        self.cancelbtn.setDisabled(True)
 
         self.btn.clicked.connect(self.doInterpolation)
+        self.cancelbtn.clicked.connect(self.cancelInterpolation)
         self.helpbtn.clicked.connect(self.callHelp)
         self.cmprbtn.clicked.connect(self.callCompare)
         
         layout.addWidget(self.pbar,5,0,1,3)
-        layout.addWidget(self.cmprbtn,6,0,1,1)
-        layout.addWidget(self.helpbtn,6,1,1,1)
-        layout.addWidget(self.btn,6,2)
+        layout.addWidget(self.status,6,0,1,2)
+        layout.addWidget(self.cancelbtn,6,2)
+        layout.addWidget(self.cmprbtn,7,0,1,1)
+        layout.addWidget(self.helpbtn,7,1,1,1)
+        layout.addWidget(self.btn,7,2)
 
         self.setWindowTitle(title)
         self.setWindowFlag(QtCore.Qt.WindowMaximizeButtonHint, False)
@@ -123,6 +134,8 @@ class MainWindow(qtw.QWidget):
         self.blend_radio = qtw.QRadioButton(text="Blending")
         self.mci_gf_radio = qtw.QRadioButton(text="Farneback motion compensation")
         self.mci_lk_radio = qtw.QRadioButton(text="Lucas-Kanade motion compensation")
+        self.auto_radio = qtw.QRadioButton(text="Adaptive (chosen for every pair of frames)")
+        self.store_check = qtw.QCheckBox(text="Keep decoded frames on disk (faster re-runs)")
 
         self.dup_radio.setChecked(True)
 
@@ -133,6 +146,8 @@ class MainWindow(qtw.QWidget):
         grid.addWidget(self.blend_radio,2,0,1,5)
         grid.addWidget(self.mci_gf_radio,3,0,1,5)
         grid.addWidget(self.mci_lk_radio,4,0,1,5)    
+        grid.addWidget(self.auto_radio,5,0,1,5)
+        grid.addWidget(self.store_check,6,0,1,5)
 
         self.disableInput()  
         
@@ -161,6 +176,8 @@ class MainWindow(qtw.QWidget):
         self.dup_radio.setDisabled(True)
         self.mci_gf_radio.setDisabled(True)
         self.mci_lk_radio.setDisabled(True)
+        self.auto_radio.setDisabled(True)
+        self.store_check.setDisabled(True)
         self.btn2.setDisabled(True)
 
     # enables the GUI when there is an input file
@@ -170,11 +187,21 @@ class MainWindow(qtw.QWidget):
         self.dup_radio.setDisabled(False)
         self.mci_gf_radio.setDisabled(False)
         self.mci_lk_radio.setDisabled(False)
+        self.auto_radio.setDisabled(False)
+        self.store_check.setDisabled(False)
         self.btn2.setDisabled(False)
 
     # updates the progress bar during the interpolation
     def updateProgressBar(self,value):
         self.pbar.setValue(value)
+
+    # updates the progress bar and the speed/remaining time label (called by the worker's signal)
+    def updateProgress(self, value, fps, eta):
+        self.updateProgressBar(value)
+        if value <= 0:                                                                        # no frame written yet: no speed to show
+            self.status.setText('estimating...')
+            return
+        self.status.setText(format(fps, ".1f") + ' frames/s - ' + str(int(eta)//60) + ':' + format(int(eta)%60, "02d") + ' left')
     
     # calls the file selector to choose an input file
     def getfile(self):
@@ -182,18 +209,16 @@ class MainWindow(qtw.QWidget):
 
         self.setCursor(QtGui.QCursor(QtCore.Qt.WaitCursor))                                  # sets cursor in wait state when loading the input file
         
-        self.frames_in = [ ]
-
         if self.fname:
-            del[self.frames_in]                                                              # prevent memory leak when another file is choosen 
-            self.frames_in, self.size, self.fps_in = read_video(self.fname)
+            self.frame_store.clear()                                                         # the frames of the previous input are not needed anymore
+            self.size, self.fps_in, self.l_frames_in = read_video_info(self.fname)          # frames are decoded only during the interpolation
             self.setCursor(QtGui.QCursor(QtCore.Qt.ArrowCursor))                             # restores cursor state
             hd_size = os.path.getsize(self.fname) / 1000000
 
             self.label1.setText(self.fname)
             self.width_out.setText(str(self.size[0]) + ' pixel')
             self.height_out.setText(str(self.size[1]) + ' pixel')
-            self.framerate_out.setText(str(self.fps_in) + ' fps')
+            self.framerate_out.setText(format(float(self.fps_in), '.6g') + ' fps')
             self.size_out.setText(str(hd_size) + ' MB')
             self.enableInput()
         if not(self.fname):
@@ -216,38 +241,124 @@ class MainWindow(qtw.QWidget):
         return self.fdir
 
     # EXECUTION
+    # the interpolation runs in a worker thread, so the GUI stays responsive and the job can be cancelled
     def doInterpolation(self):
         self.btn.setDisabled(True)
         self.label1.deselect()                                  # to prevent text selection bug in input filepath label
-        l_frames_in = len(self.frames_in)                       # number of total frames in input video
+        self.disableInput()
         fps_out = self.fps_spinbox.value()
 
-        if fps_out > self.fps_in:
-            multiplier = round(fps_out/self.fps_in)
-            l_frames_out = l_frames_in * multiplier             # number of total frames in output video
-
-            if self.dup_radio.isChecked(): self.frames_out = dup(self.frames_in, l_frames_out)
-            elif self.blend_radio.isChecked(): self.frames_out = blend(self.frames_in, l_frames_out)
-            elif self.mci_gf_radio.isChecked(): self.frames_out = mci(self.frames_in, l_frames_out, "GF")
-            elif self.mci_lk_radio.isChecked(): self.frames_out = mci(self.frames_in, l_frames_out, "LK")
-        else:
-            divisor = round(self.fps_in/fps_out)
-            l_frames_out = round(l_frames_in/divisor)
-
-            self.frames_out = gen_reduced_out(self.frames_in, l_frames_out)
-
-        output_video = generate_video(self.fdir, self.fps_spinbox.value(), self.size)
-
-        for f in self.frames_out:
-            output_video.write(f)
-        
-        del(self.frames_out)                                                                        # to prevent memory leak of output array
+        if self.dup_radio.isChecked(): mode = "dup"
+        elif self.blend_radio.isChecked(): mode = "blend"
+        elif self.mci_gf_radio.isChecked(): mode = "farneback"
+        elif self.mci_lk_radio.isChecked(): mode = "lk"
+        elif self.auto_radio.isChecked(): mode = "auto"
+
+        self.thread = QtCore.QThread()
+        frame_store = self.frame_store if self.store_check.isChecked() else None
+        self.worker = RenderWorker(self.fname, self.fdir, fps_out, mode, self.l_frames_in, frame_store)
+        self.worker.moveToThread(self.thread)
+
+        self.thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.updateProgress)
+        self.worker.finished.connect(self.interpolationCompleted)
+        self.worker.cancelled.connect(self.interpolationCancelled)
+        self.worker.failed.connect(self.interpolationFailed)
+        self.worker.done.connect(self.thread.quit, QtCore.Qt.DirectConnection)             # not queued: also quits while closeEvent waits
+
+        self.updateProgressBar(0)
+        self.status.setText("")
+        self.cancelbtn.setDisabled(False)
+        self.thread.start()
+
+    def cancelInterpolation(self):
+        self.cancelbtn.setDisabled(True)
+        self.status.setText("Cancelling...")
+        self.worker.cancel()
+
+    # restores the GUI when the worker stops, whatever the reason
+    def interpolationStopped(self):
+        self.cancelbtn.setDisabled(True)
+        self.enableInput()
+        self.btn.setDisabled(False)
+
+    def interpolationCompleted(self):
+        self.interpolationStopped()
+        qtw.QMessageBox.information(self, "Message", "Interpolation completed!")                    # shows an informative maessagebox when the interpolation is completed
+        self.cmprbtn.setDisabled(False)                                                             # enables compare button, which calls the comparison window between input and output file
+
+    def interpolationCancelled(self):
+        self.interpolationStopped()
+        self.updateProgressBar(0)
+        self.status.setText("Interpolation cancelled")
+
+    def interpolationFailed(self, message):
+        self.interpolationStopped()
+        self.status.setText("")
+        qtw.QMessageBox.critical(self, "Error", "Interpolation failed: " + message)
+
+    # a running render is cancelled and waited for (so its output is closed and removed) before the frame store,
+    # that it may be reading or writing, is cleared
+    def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
+        if self.worker is not None and self.thread.isRunning():
+            for signal in (self.worker.progress, self.worker.finished, self.worker.cancelled, self.worker.failed):
+                signal.disconnect()                                                          # no messages from a closed window
+            self.worker.cancel()
+            self.thread.wait()
+        self.frame_store.clear()
+        super().closeEvent(a0)
+
+# WORKER CLASS
+# runs the render in a QThread: the progress is sent to the GUI through signals, at most 20 times per second,
+# with the speed (input frames per second) and the estimated remaining time
+class RenderWorker(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int, float, float)                             # percentage, frames/s, remaining seconds
+    finished = QtCore.pyqtSignal()
+    cancelled = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal()                                                  # emitted after any of the three above
+
+    PROGRESS_INTERVAL = 0.05                                                    # seconds between two progress signals
+
+    def __init__(self, fname, fdir, fps_out, mode, l_frames_in, frame_store=None):
+        super().__init__()
+        self.fname = fname
+        self.fdir = fdir
+        self.fps_out = fps_out
+        self.mode = mode
+        self.l_frames_in = l_frames_in
+        self.frame_store = frame_store
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        self.start = time.perf_counter()
+        self.last_progress = 0
+
+        try:
+            render(self.fname, self.fdir, self.fps_out, self.mode, self.onProgress, cancel=self.cancel_event, frame_store=self.frame_store)
+            self.finished.emit()
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            self.done.emit()
+
+    # throttled progress callback (runs in the worker thread)
+    def onProgress(self, value):
+        now = time.perf_counter()
+        if value < 100 and now - self.last_progress < self.PROGRESS_INTERVAL: return
+        self.last_progress = now
+
+        elapsed = now - self.start
+        fps = value/100*self.l_frames_in/elapsed if elapsed > 0 else 0.0
+        eta = elapsed*(100-value)/value if value > 0 else 0.0
+        self.progress.emit(value, fps, eta)
+
+    # can be called from the GUI thread: the render stops before writing its next frame
+    def cancel(self):
+        self.cancel_event.set()
 
-        if self.pbar.value() == 100: 
-            qtw.QMessageBox.information(self, "Message", "Interpolation completed!")                # shows an informative maessagebox when the interpolation is completed
-            self.cmprbtn.setDisabled(False)                                                         # enables compare button, which calls the comparison window between input and output file
-            self.btn.setDisabled(False)
-            
 
 # HELP POP-UP CLASS
 class HelpWindow(qtw.QWidget):
@@ -263,8 +374,10 @@ class HelpWindow(qtw.QWidget):
         help_text = 'This Python program simulates <b>ffmpeg</b>\'s minterpolate command on a given video file.<br>\
                     After choosing an input video file and the output destination folder, if the desired new framerate is higher than the input\'s one, you can choose between two interpolation modes:<br>\
                     - <b>dup</b>: all the \"missing frames\" in the output video are equal to their predecessor (so, the frame <i>i</i> is a duplicate of the frame <i>i-1</i>) [<b>FAST</b>];<br>\
-                    - <b>blend</b>: all the \"missing frames\" in the output video are blended calculating the mean between their predecessor and their successor (so, the frame <i>i</i> is extimated by an average between the frame <i>i-1</i> and the frame <i>i+1</i>) <b>[SLOW]</b>;<br>\
-                    - <b>mci</b>: all the \"missing frames\" in the output video are extimated using a <b>m</b>otion <b>c</b>ompensated <i>i</i>nterpolation (so, the motion vectors from anchor frame <i>i-1</i> to target frame <i>i+1</i> are calculated to extimate the missing frame <i>i</i>). As for now, to extimate the Optical Flow, can be used the Gunnar-Farneback dense method or the Lucas-Kanade sparse method [<b>SLOWEST</b>]<br>\
+                    - <b>blend</b>: all the \"missing frames\" in the output video are blended calculating the mean between their predecessor and their successor, weighted by their temporal position (so, the frame <i>i</i> is extimated by a weighted average between the frame <i>i-1</i> and the frame <i>i+1</i>) <b>[FAST]</b>;<br>\
+                    - <b>mci</b>: all the \"missing frames\" in the output video are extimated using a <b>m</b>otion <b>c</b>ompensated <i>i</i>nterpolation (so, the motion vectors from anchor frame <i>i-1</i> to target frame <i>i+1</i> are calculated to extimate the missing frame <i>i</i>). As for now, to extimate the Optical Flow, can be used the Gunnar-Farneback dense method or the Lucas-Kanade sparse method [<b>SLOWEST</b>];<br>\
+                    - <b>auto</b>: for every pair of input frames the mode is chosen by the motion between them: dup for almost identical frames, blend for very slow motion and Gunnar-Farneback mci for the rest (useful on talking heads and screen captures).<br>\
+                    With <b>Keep decoded frames on disk</b>, the first run saves the decoded input in a temporary file, so the next runs on the same video (e.g. trying another mode) skip the decoding.<br>\
                     If, instead, the chosen new framerate is lower than the input\'s one, the selection of the mode will be ignored and the needless intermediate frames will be discarded, so that the new video will result in a lower framerate.'
         
         auth_text = '@<b>nebuchadneZZar01</b> (Michele Ferro) ~ V1.1 [2022]'
@@ -344,225 +457,9 @@ class CompareWindow(qtw.QWidget):
         self.stopVideos()
         self.destroy()
 
-# ---- CALCULATION FUNCTIONS ----
-
-# normalization in [0,100] for progressbar
-def normalize(value, min, max):
-    return int(((value-min)/(max-min))*100)
-
-def gen_out(in_a, new_length):
-    old_length = len(in_a)
-    step = round(new_length/old_length)
-    
-    # create new empty array (it will contain the frames)
-    out_a = np.array([None]*new_length)                                              
-
-    # inserting each frame of the input video with a step 
-    for i in range(old_length):
-        j = i * step
-        if j < new_length:
-            out_a[j] = in_a[i]
-
-    del[in_a]
-
-    return out_a, old_length, step
-
-# ---- VIDEO FUNCTIONS ----
-
-# dup mode: the frame i is equal to frame i-1 (his predecessor)
-def dup(in_a, new_length):
-    out_a, old_length, step = gen_out(in_a, new_length)
-
-    for i in range(new_length):
-        MainWindow.updateProgressBar(mw, normalize(i,0,new_length-1))
-        if out_a[i] is not None: pass
-        else: out_a[i] = out_a[i-1]
-
-    return out_a
-
-# blend mode: the frame i is given by the average between frame i-1 (its predecessor) and frame i+1 (its successor)
-def blend(in_a, new_length):    
-    out_a, old_length, step = gen_out(in_a, new_length)
-
-    # first case: fill the "empty frame" with the average between his successor and his predecessor
-    if round(new_length/old_length) == 2:
-        fake_new_length = old_length*2
-        for i in range(fake_new_length):
-            MainWindow.updateProgressBar(mw, normalize(i,0,fake_new_length-1))
-            if out_a[i] is not None: pass
-            elif i+1 < fake_new_length: out_a[i] = np.mean(np.array([out_a[i-1],out_a[i+1]], dtype='object'), axis=0).astype('uint8')
-            else: 
-                zero_shape = out_a[i-1].shape 
-                out_a[i] = np.mean(np.array([out_a[i-1],np.zeros(zero_shape)], dtype='object'), axis=0).astype('uint8')
-        # fill possible odd frames making average with black
-        if new_length%old_length != 0:
-            tmp = out_a[fake_new_length-1:new_length+1]
-            for i in range(len(tmp)):
-                if i == 0: pass
-                else:
-                    zero_shape = tmp[i-1].shape 
-                    tmp[i] = np.mean(np.array([tmp[i-1],np.zeros(zero_shape)], dtype='object'), axis=0).astype('uint8')
-    # second case: we have more than one empty frame, so when we have to calculate the average between the frame i and every frame in the step
-    else: 
-        for i in range(new_length):
-            if i == 0: pass
-            # dividing the list in chunks
-            else:
-                j = i * step
-                if j < new_length:
-                    tmp = out_a[j-step:j+1]
-                    # for every chunk, calculate the average
-                    for z in range(len(tmp)):
-                        if tmp[z] is None:
-                            tmp[z] = np.mean(np.array([tmp[z-1],tmp[-1]], dtype='object'), axis=0).astype('uint8')
-            MainWindow.updateProgressBar(mw, normalize(i,0,new_length-1))
-        tmp = out_a[new_length-step:new_length]
-        # remaining odd frames: average with black
-        for i in range(len(tmp)):
-            if i == 0: pass
-            else:
-                zero_shape = tmp[i-1].shape
-                tmp[i] = np.mean(np.array([tmp[i-1],np.zeros(zero_shape)], dtype='object'), axis=0).astype('uint8')
-
-    return out_a
-
-# motion compensation via dense optical flow (Gunnar-Farneback method)
-def motion_compensation_Farneback(anchor_frame, target_frame, frame_num):
-    prev = cv2.cvtColor(anchor_frame,cv2.COLOR_BGR2GRAY)                            # have to convert in gray in order to have
-    next = cv2.cvtColor(target_frame,cv2.COLOR_BGR2GRAY)                            # same channel to calculate motion vectors
-    
-    flow = cv2.calcOpticalFlowFarneback(prev, next, None, 0.5, 3, 15, 3, 5, 1.2, 0)
-
-    #ov_visualization(anchor_frame, flow, frame_num)
-
-    h, w = flow.shape[:2]
-    flow = -flow
-    flow[:,:,0] += np.arange(w)
-    flow[:,:,1] += np.arange(h)[:,np.newaxis]
-
-    return flow
-
-def motion_compensation_Lucas_Kanade(anchor_frame, target_frame, frame_num):
-    grid_y, grid_x = np.mgrid[0:anchor_frame.shape[0]:1, 0:anchor_frame.shape[1]:1]
-    p0 = np.stack((grid_x.flatten(),grid_y.flatten()),axis=1).astype(np.float32)
-
-    p1, status, err = cv2.calcOpticalFlowPyrLK(anchor_frame, target_frame, p0, None)
-
-    flow = np.reshape(p1 - p0, (anchor_frame.shape[0], anchor_frame.shape[1], 2))
-
-    #ov_visualization(anchor_frame, flow, frame_num)
-
-    h, w = flow.shape[:2]
-    flow = -flow
-    flow[:,:,0] += np.arange(w)
-    flow[:,:,1] += np.arange(h)[:,np.newaxis]
-
-    return flow
-
-def motion_compensation(anchor_frame, target_frame, frame_num, mode):
-    if mode == "GF": flow = motion_compensation_Farneback(anchor_frame, target_frame, frame_num)
-    elif mode == "LK": flow = motion_compensation_Lucas_Kanade(anchor_frame, target_frame, frame_num)
-
-    return flow
-
-def draw_hsv(anchor_frame, flow):
-    hsv = np.zeros_like(anchor_frame)
-    hsv[...,1] = 255
-    
-    mag, ang = cv2.cartToPolar(flow[...,0], flow[...,1])
-
-    hsv[...,0] = ang*180/np.pi/2
-    hsv[...,2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)
-    bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-
-    return bgr
-
-def ov_visualization(anchor_frame, flow, frame_num):
-    fname = 'img\\' + "HSV" + '\ov_' + str(frame_num) + '.jpg'
-    vis = draw_hsv(anchor_frame,flow)
-    
-    print(fname)
-    cv2.imwrite(fname, vis)
-
-# mci mode: the frame i is given by the motion compensation between frame i-1 (its predecessor) and frame i+1 (its successor)
-def mci(in_a, new_length, mode):
-    out_a, old_length, step = gen_out(in_a, new_length)
-
-    # first case: fill the "empty frame" with the motion compensation between his successor and his predecessor
-    if round(new_length/old_length) == 2:
-        fake_new_length = old_length*2
-        for i in range(fake_new_length):
-            MainWindow.updateProgressBar(mw, normalize(i,0,fake_new_length-1))
-            if out_a[i] is not None: pass
-            elif i+1 < fake_new_length:
-                flow = motion_compensation(out_a[i-1], out_a[i+1], i, mode)
-                out_a[i] = cv2.remap(out_a[i-1], flow, None, cv2.INTER_LINEAR)
-            else:
-                flow = motion_compensation(out_a[i-1], np.zeros_like(out_a[i-1]), i, mode)
-                out_a[i] = cv2.remap(out_a[i-1], flow, None, cv2.INTER_LINEAR)
-    else:
-        for i in range(new_length):
-            if i == 0: pass
-            # dividing the list in chunks
-            else:
-                j = i * step
-                if j < new_length:
-                    tmp = out_a[j-step:j+1]
-                    # for every chunk, calculate the motion compensation
-                    for z in range(len(tmp)):
-                        if tmp[z] is None:
-                            flow = motion_compensation(tmp[z-1], tmp[-1], i, mode)
-                            tmp[z] = cv2.remap(tmp[z-1], flow, None, cv2.INTER_LINEAR)
-            MainWindow.updateProgressBar(mw, normalize(i,0,new_length-1))
-        tmp = out_a[new_length-step:new_length]
-        # remaining odd frames: motion compensation with black
-        for i in range(len(tmp)):
-            if i == 0: pass
-            else:
-                flow = motion_compensation(tmp[i-1], np.zeros_like(tmp[i-1]), i, mode)
-                tmp[i] = cv2.remap(tmp[i-1], flow, None, cv2.INTER_LINEAR)                  
-    
-    return out_a
-
-# to reduce framerate
-def gen_reduced_out(in_a, new_length):
-    old_length = len(in_a)
-    step = round(old_length/new_length)                                           
-    
-    out_a = []
-
-    i = 0
-    while i < old_length:
-        out_a.append(in_a[i])
-        MainWindow.updateProgressBar(mw, normalize(i,0,old_length-1))
-        i = i + step
-    MainWindow.updateProgressBar(mw, 100)
-
-    out_a = np.array(out_a)
-    return out_a
-
-# opencv video reader suffers of memory leaks: pims is better
-def read_video(filepath):      
-    frames_rgb = pims.Video(filepath)
-    size = (frames_rgb.frame_shape[1],frames_rgb.frame_shape[0])
-    fps_in = int(frames_rgb.frame_rate)
-    frames_bgr = []
-
-    for frame in frames_rgb:
-        frames_bgr.append(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-
-    del[frames_rgb]
-
-    return frames_bgr, size, fps_in
-
-def generate_video(filepath, fps_output, size):
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')                                                # mp4v is the best encoder until now (mpg4 gave too much large output files)
-    output_video = cv2.VideoWriter(filepath, fourcc, fps_output, size, isColor = True)
-
-    return output_video
-
 # ---- MAIN EXECUTION ----
-app = qtw.QApplication([])
-mw = MainWindow()
+if __name__ == "__main__":
+    app = qtw.QApplication([])
+    mw = MainWindow()
 
-app.exec()
\ No newline at end of file
+    app.exec()
\ No newline at end of file
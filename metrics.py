@@ -1,180 +1,251 @@
+import argparse
+import csv
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import cv2
 import numpy as np
 import pandas as pd
 from skimage.metrics import structural_similarity as ssim
 
+METHODS = ("dup", "blend", "farneback", "lk")
+METRICS = ("mse", "psnr", "ssim")
+
 def input_video(filepath):
     in_vid = cv2.VideoCapture(filepath)
-    width = int(in_vid.get(3))                                                      
+    width = int(in_vid.get(3))
     height = int(in_vid.get(4))
     size = (width, height)
 
     return in_vid, size
 
-def read_video(filepath):
+# generator of the frames of a video: only one frame at a time is held in memory
+def stream_video(filepath):
     in_vid, size = input_video(filepath)
-    ret, frame = in_vid.read()
-
-    frames_in = []
 
     while (in_vid.isOpened()):
-        prev_frame = frame[:]
         ret, frame = in_vid.read()
         if ret:
             if (frame is not None):
-                frames_in.append(frame)
+                yield frame
         else: break
-    
+
     in_vid.release()
-    return frames_in, size
 
 def avg(list): return sum(list)/len(list)
 
-def PSNR(original, interpolated, size):
-    mse = np.mean((original - interpolated)**2)
+# the difference is computed in float32: on uint8 frames it would wrap around
+def MSE(original, interpolated):
+    diff = original.astype(np.float32) - interpolated.astype(np.float32)
+    return float(np.mean(diff*diff))
+
+def PSNR(original, interpolated, mse=None):
+    if mse is None: mse = MSE(original, interpolated)
 
     if (mse == 0): return 100
     max_pixel = 255.0
     psnr = 20 * np.log10(max_pixel/np.sqrt(mse))
-    return psnr
-
-def PSNR_video(original_video, interpolated_video, size):
-    if len(original_video) > len(interpolated_video): video_length = len(interpolated_video)
-    else: video_length = len(original_video)
-
-    PSNRs = [ ]
-
-    for i in range(video_length):
-        PSNRs.append(PSNR(original_video[i], interpolated_video[i], size))
-
-    min_psnr = min(PSNRs)
-    max_psnr = max(PSNRs)
-    avg_psnr = avg(PSNRs)
-
-    return min_psnr, max_psnr, avg_psnr
-
-def MSE_video(original_video, interpolated_video):
-    if len(original_video) > len(interpolated_video): video_length = len(interpolated_video)
-    else: video_length = len(original_video)
-
-    MSEs = [ ]
-
-    for i in range(video_length):
-        MSEs.append(np.mean((original_video[i] - interpolated_video[i])**2))
-
-    min_mse = min(MSEs)
-    max_mse = max(MSEs)
-    avg_mse = avg(MSEs)
-
-    return min_mse, max_mse, avg_mse
-
-def SSIM_video(original_video, interpolated_video):
-    if len(original_video) > len(interpolated_video): video_length = len(interpolated_video)
-    else: video_length = len(original_video)
-
-    SSIMs = [ ]
-
-    for i in range(video_length):
-        SSIMs.append(ssim(original_video[i], interpolated_video[i], multichannel=True))
-
-    min_ssim = min(SSIMs)
-    max_ssim = max(SSIMs)
-    avg_ssim = avg(SSIMs)
-
-    return min_ssim, max_ssim, avg_ssim
-
-
-ov_path = input("Original video path: ")
-ov_frames, size = read_video(ov_path)
-
-# DUPLICATION
-
-dup_path = input("Duplication video path: ")
-dup_frames, size = read_video(dup_path)
-
-print("Calculating metrics for Duplication method...")
-
-dup_min_mse, dup_max_mse, dup_avg_mse = MSE_video(ov_frames, dup_frames)
-dup_min_psnr, dup_max_psnr, dup_avg_psnr = PSNR_video(ov_frames, dup_frames, size)
-dup_min_ssim, dup_max_ssim, dup_avg_ssim = SSIM_video(ov_frames, dup_frames)
-
-print("Calculation complete! Freeing memory...")
-
-del(dup_frames)
-
-
-# BLENDING
+    return float(psnr)
 
-blend_path = input("Blending video path: ")
-blend_frames, size = read_video(blend_path)
+def SSIM(original, interpolated):
+    return float(ssim(original, interpolated, channel_axis=-1, data_range=255))
 
-print("Calculating metrics for Blending method...")
+# all the metrics of a pair of frames, in a single pass (unit of work of the process pool)
+def frame_metrics(original, interpolated):
+    mse = MSE(original, interpolated)
+    return mse, PSNR(original, interpolated, mse), SSIM(original, interpolated)
+
+# decodes the original and the interpolated video side by side and computes MSE, PSNR and SSIM of every pair of frames
+# in a pool of "workers" processes (all the cores by default), keeping at most 2*workers pairs in flight;
+# the comparison stops at the end of the shortest video. Returns the per-frame series of every metric.
+# an existing pool can be shared between several comparisons (see evaluate_batch)
+def compare_videos(original_path, interpolated_path, workers=None, pool=None):
+    workers = workers or os.cpu_count() or 1
+    series = {metric: [ ] for metric in METRICS}
+    pending = deque()
+
+    def collect(future):
+        for metric, value in zip(METRICS, future.result()):
+            series[metric].append(value)
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return compare_videos(original_path, interpolated_path, workers, pool)
+
+    for original, interpolated in zip(stream_video(original_path), stream_video(interpolated_path)):
+        if len(pending) >= 2*workers: collect(pending.popleft())
+        pending.append(pool.submit(frame_metrics, original, interpolated))
+
+    while pending: collect(pending.popleft())
+
+    return series
+
+def summary(values):
+    return min(values), max(values), avg(values)
+
+# builds the table of the csv_metrics files: a <method>_<metric> column for every compared method, min/max/avg rows
+def metrics_dataframe(results):
+    columns = { }
+    for method, series in results.items():
+        for metric in METRICS:
+            columns[method + "_" + metric] = list(summary(series[metric]))
+
+    return pd.DataFrame(columns, index=['min', 'max', 'avg'])
+
+# per-frame series of every method, one row per frame
+def frames_dataframe(results):
+    columns = { }
+    for method, series in results.items():
+        for metric in METRICS:
+            columns[method + "_" + metric] = pd.Series(series[metric], dtype=float)
+
+    return pd.DataFrame(columns)
+
+# ---- BATCH EVALUATION ----
+
+# entries of a batch: (name, reference, candidate, method), where name is the table (csv file) the entry belongs to
+
+# manifest: a csv file with the columns reference, candidate, method and, optionally, name
+# (by default the name of the reference file)
+def read_manifest(filepath):
+    entries = [ ]
+    base = os.path.dirname(filepath)
+
+    with open(filepath, newline='') as f:
+        for row in csv.DictReader(f):
+            reference = os.path.join(base, row["reference"])
+            name = row.get("name") or os.path.splitext(os.path.basename(reference))[0]
+            entries.append((name, reference, os.path.join(base, row["candidate"]), row["method"]))
+
+    return entries
+
+# name of the clip of a candidate file, without method and framerates (asahi30_blend.mp4 -> asahi, gibson5-30_dup.mp4 -> gibson)
+def clip_name(filename, method):
+    name = os.path.splitext(filename)[0]
+    if name.endswith("_" + method): name = name[:-len(method)-1]
+    return re.sub(r'\d+(-\d+)?$', '', name)
+
+# directory layout like test/metrics/reinterpolated_15-30/<method>/<clip>*.mp4: the reference of every clip is
+# <references>/<clip>.mp4 and the tables are named <clip><framerates> (e.g. gibson5-30), as the files in csv_metrics
+def scan_layout(directory, references):
+    entries = [ ]
+    rates = os.path.basename(os.path.normpath(directory)).rpartition("_")[2]
 
-blend_min_mse, blend_max_mse, blend_avg_mse = MSE_video(ov_frames, blend_frames)
-blend_min_psnr, blend_max_psnr, blend_avg_psnr = PSNR_video(ov_frames, blend_frames, size)
-blend_min_ssim, blend_max_ssim, blend_avg_ssim = SSIM_video(ov_frames, blend_frames)
+    for method in sorted(os.listdir(directory)):
+        method_dir = os.path.join(directory, method)
+        if not os.path.isdir(method_dir): continue
 
-print("Calculation complete! Freeing memory...")
+        for filename in sorted(os.listdir(method_dir)):
+            if not filename.endswith(".mp4"): continue
+            clip = clip_name(filename, method)
+            reference = os.path.join(references, clip + ".mp4")
 
-del(blend_frames)
+            if not os.path.exists(reference):
+                print("No reference for " + os.path.join(method_dir, filename) + " (expected " + reference + "), skipped")
+                continue
 
+            entries.append((clip + rates, reference, os.path.join(method_dir, filename), method))
 
-# FARNEBACK
+    return entries
+
+# evaluates all the entries concurrently: up to "jobs" comparisons decode their videos at the same time,
+# and all of them share a single pool of "workers" processes for the metrics.
+# an entry that can't be evaluated (missing or unreadable video, no frames to compare) is logged and skipped,
+# so the tables of the other entries are still written. returns {name: {method: series}} and the skipped entries
+def evaluate_batch(entries, workers=None, jobs=4, log=print):
+    workers = workers or os.cpu_count() or 1
+    results = { }
+    skipped = [ ]
 
-farneback_path = input("Farneback video path: ")
-farneback_frames, size = read_video(farneback_path)
+    def evaluate(entry):
+        name, reference, candidate, method = entry
+        try:
+            for path in (reference, candidate):
+                if not os.path.isfile(path): raise FileNotFoundError("no such file " + path)
+            series = compare_videos(reference, candidate, workers, pool)
+            if not all(series[metric] for metric in METRICS): raise ValueError("no frames to compare")
+        except Exception as e:
+            log("Skipped: " + name + " (" + method + "), " + candidate + ": " + str(e))
+            return None
 
-print("Calculating metrics for Farnebäck method...")
+        log("Calculation complete: " + name + " (" + method + ")")
+        return series
 
-farneback_min_mse, farneback_max_mse, farneback_avg_mse = MSE_video(ov_frames, farneback_frames)
-farneback_min_psnr, farneback_max_psnr, farneback_avg_psnr = PSNR_video(ov_frames, farneback_frames, size)
-farneback_min_ssim, farneback_max_ssim, farneback_avg_ssim = SSIM_video(ov_frames, farneback_frames)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as threads:
+            for entry, series in zip(entries, threads.map(evaluate, entries)):
+                if series is None: skipped.append(entry)
+                else: results.setdefault(entry[0], { })[entry[3]] = series
 
-print("Calculation complete! Freeing memory...")
+    return results, skipped
 
-del(farneback_frames)
+# writes a <name>_metrics.csv table for every name of the batch (and the per-frame <name>_frames.csv, if frames is True);
+# the known methods come first, in the same order of the csv_metrics tables
+def write_tables(results, out_dir, frames=False):
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, methods in results.items():
+        ordered = sorted(methods, key=lambda m: METHODS.index(m) if m in METHODS else len(METHODS))
+        ordered = {method: methods[method] for method in ordered}
 
+        metrics_dataframe(ordered).to_csv(os.path.join(out_dir, name + "_metrics.csv"))
+        if frames: frames_dataframe(ordered).to_csv(os.path.join(out_dir, name + "_frames.csv"))
 
-# LUCAS-KANADE
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Quality metrics (MSE, PSNR, SSIM) of interpolated videos; without arguments asks the paths interactively")
+    parser.add_argument("--manifest", help="csv file with the columns reference, candidate, method (and optionally name)")
+    parser.add_argument("--layout", help="directory with a <method>/<clip>*.mp4 layout, e.g. test/metrics/reinterpolated_15-30")
+    parser.add_argument("--references", default="test", help="directory of the original videos of --layout")
+    parser.add_argument("--out", default="csv_metrics", help="directory of the output tables")
+    parser.add_argument("--frames", action="store_true", help="also write the per-frame metrics")
+    parser.add_argument("--workers", type=int, help="processes computing the metrics (all the cores by default)")
+    parser.add_argument("--jobs", type=int, default=4, help="comparisons decoded at the same time")
 
-lk_path = input("Lucas-Kanade video path: ")
-lk_frames, size = read_video(lk_path)
+    return parser.parse_args(argv)
 
-print("Calculating metrics for Lucas-Kanade method...")
+def interactive():
+    ov_path = input("Original video path: ")
+
+    results = { }
+    names = {"dup": "Duplication", "blend": "Blending", "farneback": "Farnebäck", "lk": "Lucas-Kanade"}
 
-lk_min_mse, lk_max_mse, lk_avg_mse = MSE_video(ov_frames, lk_frames)
-lk_min_psnr, lk_max_psnr, lk_avg_psnr = PSNR_video(ov_frames, lk_frames, size)
-lk_min_ssim, lk_max_ssim, lk_avg_ssim = SSIM_video(ov_frames, lk_frames)
+    for method in METHODS:
+        path = input(names[method] + " video path: ")
+
+        print("Calculating metrics for " + names[method] + " method...")
+        results[method] = compare_videos(ov_path, path)
+        print("Calculation complete!")
 
-print("Calculation complete! Freeing memory...")
+    print("Creating final data frame...")
+    df = metrics_dataframe(results)
 
-print("Creating final data frame...")
-dup_mse = pd.DataFrame({'dup_mse': [dup_min_mse, dup_max_mse, dup_avg_mse]})
-dup_psnr = pd.DataFrame({'dup_psnr': [dup_min_psnr, dup_max_psnr, dup_avg_psnr]})
-dup_ssim = pd.DataFrame({'dup_ssim': [dup_min_ssim, dup_max_ssim, dup_avg_ssim]})
+    print(df)
 
-blend_mse = pd.DataFrame({'blend_mse': [blend_min_mse, blend_max_mse, blend_avg_mse]})
-blend_psnr = pd.DataFrame({'blend_psnr': [blend_min_psnr, blend_max_psnr, blend_avg_psnr]})
-blend_ssim = pd.DataFrame({'blend_ssim': [blend_min_ssim, blend_max_ssim, blend_avg_ssim]})
+    save_fp = input("Enter save path: ")
 
-farneback_mse = pd.DataFrame({'farneback_mse': [farneback_min_mse, farneback_max_mse, farneback_avg_mse]})
-farneback_psnr = pd.DataFrame({'farneback_psnr': [farneback_min_psnr, farneback_max_psnr, farneback_avg_psnr]})
-farneback_ssim = pd.DataFrame({'farneback_ssim': [farneback_min_ssim, farneback_max_ssim, farneback_avg_ssim]})
+    df.to_csv(save_fp)
 
-lk_mse = pd.DataFrame({'lk_mse': [lk_min_mse, lk_max_mse, lk_avg_mse]})
-lk_psnr = pd.DataFrame({'lk_psnr': [lk_min_psnr, lk_max_psnr, lk_avg_psnr]})
-lk_ssim = pd.DataFrame({'lk_ssim': [lk_min_ssim, lk_max_ssim, lk_avg_ssim]})
+    frames_fp = input("Enter save path of the per-frame metrics (empty to skip): ")
+    if frames_fp: frames_dataframe(results).to_csv(frames_fp)
 
-df = pd.concat([dup_mse, dup_psnr, dup_ssim,\
-                blend_mse, blend_psnr, blend_ssim,\
-                farneback_mse, farneback_psnr, farneback_ssim,\
-                lk_mse, lk_psnr, lk_ssim], axis=1)
+def main(argv=None):
+    args = parse_args(argv)
 
-df.index = ['min', 'max', 'avg']
+    if not (args.manifest or args.layout):
+        interactive()
+        return
 
-print(df)
+    entries = [ ]
+    if args.manifest: entries += read_manifest(args.manifest)
+    if args.layout: entries += scan_layout(args.layout, args.references)
 
-save_fp = input("Enter save path: ")
+    print("Evaluating " + str(len(entries)) + " videos...")
+    results, skipped = evaluate_batch(entries, args.workers, args.jobs)
+    write_tables(results, args.out, args.frames)
+    print("Tables written in " + args.out + (" (" + str(len(skipped)) + " videos skipped)" if skipped else ""))
 
-df.to_csv(save_fp)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc per-stage instrumentation of the render pipeline (decode, convert, flow, remap, blend, write, encode):
+ #       cumulative time, calls and latency percentiles, dumpable as json or as a Chrome trace (chrome://tracing)
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# the profiler in use; when it is None, profile() returns a shared empty context manager,
+# so the instrumented code costs only a function call
+active = None
+disabled = nullcontext()
+
+# collects the duration of every call of every stage (from any thread of this process: the workers of a process pool
+# have their own profiler, which is disabled); with trace=True it also keeps the events for the Chrome trace
+class Profiler:
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.durations = { }                                                    # stage -> list of durations in seconds
+        self.events = [ ]                                                       # (stage, start, duration, thread id)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def record(self, name, start, duration):
+        with self.lock:
+            self.durations.setdefault(name, [ ]).append(duration)
+            if self.trace: self.events.append((name, start, duration, threading.get_ident()))
+
+    # cumulative time, calls and latency percentiles (milliseconds) of every stage
+    def report(self):
+        report = { }
+        with self.lock:
+            for name, durations in self.durations.items():
+                d = np.array(durations) * 1000
+                report[name] = {"calls": len(d),
+                                "total_s": float(d.sum()) / 1000,
+                                "mean_ms": float(d.mean()),
+                                "p50_ms": float(np.percentile(d, 50)),
+                                "p90_ms": float(np.percentile(d, 90)),
+                                "p99_ms": float(np.percentile(d, 99)),
+                                "max_ms": float(d.max())}
+
+        return report
+
+    def dump_json(self, filepath):
+        with open(filepath, "w") as f: json.dump(self.report(), f, indent=2)
+
+    # complete events ("ph": "X") of the Trace Event Format, one row per thread
+    def dump_chrome_trace(self, filepath):
+        pid = os.getpid()
+        with self.lock:
+            events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                       "ts": (start - self.origin) * 1000000, "dur": duration * 1000000}
+                      for name, start, duration, tid in self.events]
+
+        with open(filepath, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def enable(trace=False):
+    global active
+    active = Profiler(trace)
+    return active
+
+def disable():
+    global active
+    profiler, active = active, None
+    return profiler
+
+# instrumentation point: with profile("flow"): ...
+def profile(name):
+    if active is None: return disabled
+    return active.stage(name)
@@ -0,0 +1,53 @@
+"""
+ # @author nebuchadnezzar
+ # @email michele.ferro1998@libero.it
+ # @desc scene-cut detection: the pairs of frames across a shot boundary are not motion compensated
+"""
+import cv2
+
+from profiling import profile
+
+# "hist": Bhattacharyya distance between the color histograms, "mad": mean absolute difference of the gray frames;
+# both scores are in [0,1] and are computed on thumbnails, so they cost a small fraction of a flow estimation
+CUT_METHODS = {"hist": 0.35, "mad": 0.08}                                       # method -> default threshold
+CUT_FALLBACKS = ("dup", "blend")
+
+# calling it on two consecutive BGR frames tells if there is a cut between them (score above threshold);
+# the detected cuts are recorded in "cuts" as the index of the first source frame of the new shot.
+# fallback is the mode ("dup" or "blend") that fills the missing frames of a pair across a cut
+class SceneCutDetector:
+    def __init__(self, method="hist", threshold=None, fallback="dup", size=(64, 36)):
+        if method not in CUT_METHODS: raise ValueError("unknown scene-cut method: " + str(method))
+        if fallback not in CUT_FALLBACKS: raise ValueError("unknown scene-cut fallback: " + str(fallback))
+
+        self.method = method
+        self.threshold = threshold if threshold is not None else CUT_METHODS[method]
+        self.fallback = fallback
+        self.size = size
+        self.cuts = [ ]
+        self.previous = None                                                    # (frame, its features): the target of a pair is the anchor of the next one
+
+    def __call__(self, anchor_frame, target_frame, index):
+        with profile("scene_cut"): cut = self.score(anchor_frame, target_frame) > self.threshold
+        if cut: self.cuts.append(index + 1)
+
+        return cut
+
+    def score(self, anchor_frame, target_frame):
+        a, b = self.features(anchor_frame), self.features(target_frame)
+
+        if self.method == "hist": return float(cv2.compareHist(a, b, cv2.HISTCMP_BHATTACHARYYA))
+        return float(cv2.absdiff(a, b).mean()) / 255
+
+    def features(self, frame):
+        if self.previous is not None and self.previous[0] is frame: return self.previous[1]
+
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if self.method == "hist":
+            features = cv2.calcHist([small], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+            cv2.normalize(features, features, 1, 0, cv2.NORM_L1)
+        else:
+            features = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        self.previous = (frame, features)
+        return features